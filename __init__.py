@@ -29,12 +29,19 @@
 
 from neon_utils.skills.neon_skill import NeonSkill, LOG
 from mycroft.skills.core import intent_file_handler
+from mycroft_bus_client import Message
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Event, Thread
+import time
 from .request_handling import RequestHandler
-from .request_handling import existing_lang_check, get_shop_data,\
+from .request_handling import existing_lang_check, get_mall_registry,\
                                 shop_selection_by_floors,\
-                                location_format,\
-                                curent_time_extraction
-import re
+                                shop_speech,\
+                                curent_time_extraction, clock_minutes,\
+                                format_clock, minutes_until, open_mask,\
+                                open_all_day,\
+                                shop_hours_arrays, valid_lang,\
+                                LatencyHistograms, MallSession, QueryTimer
 
 
 
@@ -43,23 +50,123 @@ class DirectorySkill(NeonSkill):
     def __init__(self):
         super(DirectorySkill, self).__init__(name="DirectorySkill")
         self.url = "https://www.alamoanacenter.com/en/directory/"
+        self._query_executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix='mall-query')
+        self._query_cancel = Event()
+        self._query_future = None
+        self._query_timer = QueryTimer()
+        self._latency = LatencyHistograms()
 
 
     def initialize(self):
+        self.on_settings_changed()
+        self.settings_change_callback = self.on_settings_changed
+        # Build mall's cache before the first question
+        Thread(target=self.warm_up, name='mall-cache-warm-up',
+               daemon=True).start()
+        self.add_event('mall-guide.latency', self.handle_latency_request)
+        self.add_event('mall-guide.stats', self.handle_stats_request)
+        self.add_event('mall-guide.refresh', self.handle_refresh_request)
         # When first run or prompt not dismissed, wait for load and prompt user
         if self.settings.get('prompt_on_start'):
             self.bus.once('mycroft.ready', self._start_mall_parser_prompt)
 
+    def on_settings_changed(self):
+        """
+        Applies storage backend and logo cache size
+        settings to the mall registry, so a query in
+        progress keeps the ones it started with.
+        """
+        registry = self.mall_registry
+        registry.backend = self.settings.get("storage_backend") or 'json'
+        registry.logos.max_bytes = \
+            int(float(self.settings.get("logo_cache_mb", 50)) * 1024 * 1024)
+        registry.on_change = self.report_cache_changes
+
+    def warm_up(self):
+        """
+        Checks user's language on the mall's page and
+        builds or refreshes mall's cache with its indexes.
+        Runs in background at skill initialization, queries
+        arriving meanwhile wait for the same cache refresh.
+        Returns:
+            bool: True if mall's cache is ready
+        """
+        try:
+            found, link = existing_lang_check(self.request_lang,
+                                              self.mall_link(),
+                                              self.file_system.path)
+            if not found:
+                return False
+            return self.mall_registry.warm_up(self.mall_link(),
+                                              self.request_lang,
+                                              self.cache_ttl)
+        except Exception as e:
+            LOG.error(f"Mall's cache warm-up failed: {e}")
+            return False
+
     @intent_file_handler("run_mall_parser.intent")
     def start_mall_parser_intent(self, message):
         LOG.info(message.data)
         self._start_mall_parser_prompt(message)
         return
 
+    def stop(self):
+        """
+        Cancels the shop search in progress
+        """
+        return self._cancel_query()
+
+    def _cancel_query(self):
+        """
+        Stops waiting for the running shop search. The
+        mall's cache build it may be waiting for is shared
+        with the warm-up and other queries, so it goes on
+        in the background.
+        Returns:
+            bool: True if a search was in progress
+        """
+        future = self._query_future
+        if future is None or future.done():
+            return False
+        self._query_cancel.set()
+        future.cancel()
+        return True
+
     # @property
     def mall_link(self):
         mall_link = 'https://www.alamoanacenter.com/'
-        return self.settings.get("mall_link") or mall_link
+        return (self.settings.get("mall_link") or mall_link).rstrip('/')+'/'
+
+    @property
+    def request_lang(self):
+        """
+        User's language in ISO 639-1
+        """
+        return self.lang.split('-')[0]
+
+    @property
+    def mall_registry(self):
+        """
+        Cache shards of all malls and languages,
+        see on_settings_changed()
+        """
+        return get_mall_registry(self.file_system.path)
+
+    @property
+    def response_budget(self):
+        """
+        Seconds the shop search may take before the
+        skill answers from the old cache or apologizes
+        """
+        return float(self.settings.get("response_budget_seconds", 5))
+
+    @property
+    def cache_ttl(self):
+        """
+        Mall's cache lifetime in seconds, 0 to never refresh
+        """
+        return float(self.settings.get("cache_ttl_hours", 24)) * 3600
 
     def user_request_handling(self, message):
         """
@@ -68,73 +175,130 @@ class DirectorySkill(NeonSkill):
         Returns:
             None, None: if message is empty
             None, None: if language is not supported
-            user_request, link (str, str): if language exists
-            answer)
+            user_request, mall_link (str, str): if language exists
         """
         LOG.info(f"Message is {message.data}")
         if message.data == {} or message is None:
             return None, None
         else:
-            request_lang = self.lang.split('-')[0]
+            request_lang = self.request_lang
             user_request = message.data['shop']
             LOG.info(f"{self.mall_link()}")
             LOG.info(str(request_lang))
             LOG.info(user_request)
-            found, link = existing_lang_check(request_lang, self.mall_link())
+            with self._query_timer.span('language_check'):
+                found, link = existing_lang_check(request_lang,
+                                                  self.mall_link(),
+                                                  self.file_system.path)
             if found:
-                link = self.mall_link()+request_lang+'/directory/'
                 LOG.info('new link: '+ link)
-                return user_request, link
+                return user_request, self.mall_link()
             else:
                 self.speak_dialog("no_lang")
                 return None, None
 
-    def start_again(self):
+    def start_again(self, session):
         """
         Asks yes/no question whether user wants to
         get another shop info, after Neon gave the
         information about previously selected shop.
         If user's answer 'yes': asks what shop is
-        needed. Returns user's answer.
+        needed and starts its search.
+        If user asks a follow-up question about the
+        shops found last, answers it, see follow_up().
         If 'no', speaks corresponding dialog.
         If some other answer, speaks corresponding
         dialog
-        Returns:
-            None (if no shop in request, if user's
-            answer is 'no', if user gives some other
-            answer)
+        Args:
+            session (MallSession): current conversation
         """
         start_again = self.ask_yesno("ask_more")
         if start_again == "yes":
             another_shop = self.get_response('another_shop')
             if another_shop is not None:
                 LOG.info(f'another shop {another_shop}')
-                return another_shop
+                # "Foot Locker level 2" names a shop, it isn't
+                # a question about the shops found last
+                if self.names_shop(session, another_shop) or \
+                        not self.follow_up(session, another_shop):
+                    session.new_request(another_shop)
+                return
         elif start_again == "no":
             self.speak_dialog('no_shop_request')
+        elif start_again and self.follow_up(session, start_again):
+            return
         else:
             self.speak_dialog('unexpected_error')
-        return None
+        session.state = session.DONE
+
+    def names_shop(self, session, utterance):
+        """
+        Checks if the answer is a shop name known
+        from the mall's current cache
+        Args:
+            session (MallSession): current conversation
+            utterance (str): user's answer
+        Returns:
+            bool: True if a shop is found by the answer
+        """
+        return bool(self.mall_registry.cached_shop_data(
+            session.link, session.lang, utterance))
+
+    def follow_up(self, session, utterance):
+        """
+        Answers questions about the shops found last
+        without searching them again, e.g. "which one
+        is open?" or "which one is on the second floor?"
+        Args:
+            session (MallSession): current conversation
+            utterance (str): user's answer
+        Returns:
+            bool: True if it was a follow-up question
+        """
+        if not session.shops:
+            return False
+        if self.voc_match(utterance, "open"):
+            LOG.info('Follow-up about open shops')
+            self.shops_by_time_selection(session.shops, session)
+        elif self.voc_match(utterance, "location"):
+            LOG.info('Follow-up about shop location')
+            self.location_selection(session.shops, utterance, session)
+        else:
+            return False
+        return True
 
     def speak_shops(self, shop_info):
         """
         Speaks shop info that was found.
-        Substitutes time format for better pronunciation.
+        Uses hours and location precomputed for
+        pronunciation when the cache was built.
         speak_dialog('found_shop', {"name": shop['name'], "hours": hours, "location": location})
-        Shows shop label image in gui.
+        Shows shop label image in gui, from the local
+        logo cache if the logo was downloaded.
         Args:
             shop_info (list): found shops on user's
                                 request
         """
-        for shop in shop_info:
-            LOG.info(shop)
-            location = location_format(shop['location'])
-            hours = re.sub('(\d+)am.+(\d+)pm', r'from \1 A M to \2 P M', shop['hours'])
-            self.speak_dialog('found_shop', {"name": shop['name'], "hours": hours, "location": location})
-            LOG.info({"name": shop['name'], "hours": hours, "location": location})
-            self.gui.show_image(shop['logo'], caption=f'{hours} {location}', title=shop['name'])
+        with self._query_timer.span('speak'):
+            for shop in shop_info:
+                LOG.info(shop)
+                hours, location = shop_speech(shop, self.request_lang)
+                self.speak_dialog('found_shop', {"name": shop['name'], "hours": hours, "location": location})
+                LOG.info({"name": shop['name'], "hours": hours, "location": location})
+                logo = self.mall_registry.logos.local_path(shop['logo']) or shop['logo']
+                self.gui.show_image(logo, caption=f'{hours} {location}', title=shop['name'])
+
+    def session_store(self, session):
+        """
+        Returns SQLite store of the session's mall and
+        language, None for the JSON backend or without
+        a session
+        """
+        if session is None:
+            return None
+        return self.mall_registry.store(session.link, session.lang)
 
-    def location_selection(self, shop_info):
+    def location_selection(self, shop_info, floor=None, session=None):
         """
         If there are several shops in found shops list
         and user wants to get shop info on the certain
@@ -143,46 +307,52 @@ class DirectorySkill(NeonSkill):
         Args:
             shop_info (list): found shops on user's
                                 request
-        Returns:
-            3, None (to ask for another shop info)
+            floor (str): user's answer naming the floor,
+                         asked for if there is no floor in it
+            session (MallSession): current conversation, shops
+                                   are selected in its mall's store
         """
         LOG.info(f"Shop by location selection {shop_info}")
-        floor = self.get_response('which_floor')
-        shops = shop_selection_by_floors(floor, shop_info)
+        lang = session.lang if session else self.request_lang
+        store = self.session_store(session)
+        shops = shop_selection_by_floors(floor, shop_info, lang,
+                                         store) if floor else []
+        if not shops:
+            floor = self.get_response('which_floor')
+            shops = shop_selection_by_floors(floor, shop_info, lang, store)
         if shops:
             self.speak_shops(shops)
         else:
             self.speak_dialog('no_shop_on_level')
             self.speak_shops(shop_info)
-        return 3, None
 
-    def open_shops_search(self, shop_info, day_time, hour, min):
+    def open_shops_search(self, shop_info, day_time, hour, min,
+                          session=None):
         """
        Selects open shops. Collects the list of
        open shops else return empty list.
+       All shops are checked in one vectorized pass
+       over their precomputed working hours, or by
+       the hours index of the SQLite store.
        Args:
            shop_info (list): found shops on user's
                                request
+           session (MallSession): current conversation, shops
+                                  are selected in its mall's store
        Returns:
            shop_info (list): open shops
        """
-        open_shops = []
         LOG.info(f"User's time {day_time, hour, min}")
-        for shop in shop_info:
-            parse_time = re.findall(r'(\d+)+[am|pm]', shop['hours'])
-            LOG.info(f'Parsed time {parse_time}')
-            open_time = int(parse_time[0])
-            close_time = int(parse_time[1])
-            if open_time <= hour < close_time:
-                open_shops.append(shop)
-            elif day_time[1] == 'am' and open_time <= hour:
-                open_shops.append(shop)
-        return open_shops
-
+        minutes = clock_minutes(day_time[1], hour, min)
+        store = self.session_store(session)
+        if store is not None:
+            return store.open_now(minutes,
+                                  {shop['name'] for shop in shop_info})
+        opens, closes = shop_hours_arrays(shop_info)
+        mask = open_mask(opens, closes, minutes)
+        return [shop for shop, is_open in zip(shop_info, mask) if is_open]
 
     def time_calculation(self, shop_info, open, day_time, hour, min):
-        # add logic if shop opens and closes not at am-pm time period
-        # change to speak dialog
         """
         Calculates time difference between user's current time
         and shop working hours.
@@ -195,11 +365,10 @@ class DirectorySkill(NeonSkill):
             Speaks corresponding dialog.
             If user is one hour or less before opening hours 
                 speaks how much time is left for waiting. 
-            If user's time is 'am' and user is before opening
-                hours, speaks how many hours and minutes left 
-                waiting.
-            If user's time is evening (pm) speaks when the shop 
-                opens in the morning.
+            If user is before opening hours, speaks how many
+                hours and minutes left waiting.
+            If shop is already closed today speaks when the
+                shop opens.
                 Speaks shop info.
         Args:
             shop_info (list): found shops on user's request
@@ -207,75 +376,69 @@ class DirectorySkill(NeonSkill):
             day_time (str): user's current day time (am|pm) 
             hour (int): user's current hour
             min (int): user's current minute
-        Returns:
-            3, None (to ask for another shop info)
         Examples:
             work time 9am-10pm
             user's time 8am
             Prompt: 'Shop is closed now. Opens in 1 hour'
         """
-        for shop in shop_info:
-            work_time = shop['hours']
-            normalized_time = re.findall(r'(\d+)[am|pm]', work_time)
-            open_time = int(normalized_time[0])
-            close_time = int(normalized_time[1])
-            LOG.info(f'work_time {work_time}')
+        minutes = clock_minutes(day_time[1], hour, min)
+        opens, closes = shop_hours_arrays(shop_info)
+        till_open = minutes_until(opens, minutes)
+        till_close = minutes_until(closes, minutes)
+        all_day = open_all_day(opens, closes)
+        for i, shop in enumerate(shop_info):
             shop_name = shop['name']
-            parse_time = work_time.split('-')
-            LOG.info(f'parse_time {parse_time}')
-            # time left
-            wait_h = open_time - hour - 1
-            wait_min = 60 - min
-            if open:
-                if day_time[1] == 'pm' and 0 < (close_time - hour) <= 1:
+            LOG.info(f"work_time {shop['hours']}")
+            if opens[i] < 0:
+                LOG.info(f'{shop_name} has unknown working hours')
+            elif open or all_day[i]:
+                # shops open 24 hours never close
+                if till_close[i] <= 60 and not all_day[i]:
+                    wait_min = int(till_close[i])
                     LOG.info(f'{shop_name} closes in {wait_min} minutes.')
                     self.speak_dialog('closing_minutes', {"shop_name": shop_name, "wait_min": wait_min})
                 else:
                     LOG.info(f'{shop_name} is open.')
                     self.speak_dialog('open_now', {'shop_name':  shop_name})
-                LOG.info([shop])
-                self.speak_shops([shop])
             else:
-                if day_time[1] == 'am' and hour < open_time:
-                    if wait_h == 0:
-                        LOG.info(f'{shop_name} is closed now. Opens in {wait_min} minutes')
-                        self.speak_dialog('opening_minutes', {"shop_name": shop_name, "wait_min": wait_min})
-                    else:
-                        LOG.info(f'{shop_name} is closed now. Opens in {wait_h} hour and {wait_min} minutes')
-                        self.speak_dialog('opening_hours', {"shop_name": shop_name, "wait_h": wait_h, "wait_min": wait_min})
-                elif hour >= close_time:
+                wait_h, wait_min = divmod(int(till_open[i]), 60)
+                if minutes < opens[i] and wait_h == 0:
+                    LOG.info(f'{shop_name} is closed now. Opens in {wait_min} minutes')
+                    self.speak_dialog('opening_minutes', {"shop_name": shop_name, "wait_min": wait_min})
+                elif minutes < opens[i]:
+                    LOG.info(f'{shop_name} is closed now. Opens in {wait_h} hour and {wait_min} minutes')
+                    self.speak_dialog('opening_hours', {"shop_name": shop_name, "wait_h": wait_h, "wait_min": wait_min})
+                else:
+                    open_time = format_clock(opens[i])
                     LOG.info(f'{shop_name} is closed now. Shop opens at {open_time}')
                     self.speak_dialog('closed_now', {'shop_name': shop_name, 'open_time': open_time})
-                LOG.info([shop])
-                self.speak_shops([shop])
-        return 3, None
+            LOG.info([shop])
+            self.speak_shops([shop])
 
-    def shops_by_time_selection(self, shop_info):
+    def shops_by_time_selection(self, shop_info, session=None):
         """
         If user chose to select shops by time or
         use like default selection. Gets user's
         current time. Selects open shops. 
+        Speaks open shops with time_calculation()
+        with True in 'open' argument, if there are
+        no open shops speaks all of them with False.
         Args:
            shop_info (list): found shops on user's
                                request
-        Returns:
-            time_calculation function with True 
-                in 'open' argument.
-            time_calculation function with False 
-                in 'open' argument. (if list
-                of open shops is 0)
-           
+           session (MallSession): current conversation
         """
         LOG.info(f"Shop by time selection {shop_info}")
         day_time, hour, min = curent_time_extraction()
         # day_time, hour, min = ['11:15', 'pm'], 11, 15
-        open_shops = self.open_shops_search(shop_info, day_time, hour, min)
+        open_shops = self.open_shops_search(shop_info, day_time, hour, min,
+                                            session)
         if len(open_shops) >= 1:
-            return self.time_calculation(open_shops, True, day_time, hour, min)
+            self.time_calculation(open_shops, True, day_time, hour, min)
         else:
-            return self.time_calculation(shop_info, False, day_time, hour, min)
+            self.time_calculation(shop_info, False, day_time, hour, min)
 
-    def find_shop(self, user_request, mall_link):
+    def find_shop(self, session):
         """
         When the intent is matched, user_request
         variable contains the name of the shop.
@@ -285,11 +448,61 @@ class DirectorySkill(NeonSkill):
         If user's request is not None this function
         can return several shops, one shop or empty
         list.
-        If no shop was found asks user to repeat.
-        returns 1, user_request to continue the
-        execution loop in self.execute().
-        If there are several shops asks user what way
-        of sorting to choose: time, level, nothing.
+        If no shop was found asks user to repeat,
+        the session searches again up to
+        MallSession.max_attempts times.
+        If there are several shops the session goes
+        on with select_shops().
+        If there was one shop found speaks this
+        shop info and the session asks for another
+        shop.
+        If user asked for several shops at once
+        and at least two of them were found answers
+        about all of them together, see
+        speak_found_shops(). Parts of the request
+        that aren't shop names, like "please" in
+        "ABC Stores, please", are dropped otherwise.
+        Args:
+            session (MallSession): current conversation
+        """
+        user_request = session.user_request
+        LOG.info(f'user_request {user_request}')
+        LOG.info(f'mall_link {session.link}')
+        session.state = session.AGAIN
+        self.speak_dialog("start_parsing")
+        LOG.info(f"I am parsing shops and malls for your request")
+        found = self.fetch_shops(session)
+        if found is None:
+            if self._query_cancel.is_set():
+                session.state = session.DONE
+            else:
+                self.speak_dialog('still_loading')
+            return
+        shop_info = [shop for _, shops in found for shop in shops]
+        LOG.info(f"I found {len(shop_info)} shops")
+        LOG.info(f"shop list: {shop_info}")
+        if len(shop_info) == 0:
+            session.attempts += 1
+            user_request = self.get_response('shop_not_found')
+            if user_request is not None and \
+                    session.attempts < session.max_attempts:
+                session.user_request = user_request
+                session.state = session.SEARCH
+            return
+        session.shops = shop_info
+        if sum(1 for _, shops in found if shops) > 1:
+            self.speak_found_shops(found)
+        elif len(shop_info) > 1:
+            self.speak_dialog('more_than_one')
+            session.state = session.SELECT
+        else:
+            LOG.info(f"found shop {shop_info}")
+            self.speak_shops(shop_info)
+
+    def select_shops(self, session):
+        """
+        Asks for the way of selection among several
+        found shops: time, location, nothing.
             If 'time' - finds open shops. If open shops
             list is not empty speaks open shops, else
             tells time difference between user and shops'
@@ -300,61 +513,206 @@ class DirectorySkill(NeonSkill):
             and speaks all found shops.
             If  'no' - sorts by time.
             If nothing matched in the answer - sorts by time.
-        If there was one shop found speaks this
-        shop info. Returns 3, None to stop current
-        shop search.
-        Location and time sorting functions return
-        3, None to stop current shop search.
+        Args:
+            session (MallSession): current conversation
         """
-        LOG.info(f'user_request {user_request}')
-        LOG.info(f'mall_link {mall_link}')
-        if user_request is not None:
-            self.speak_dialog("start_parsing")
-            LOG.info(f"I am parsing shops and malls for your request")
-            file_path = self.file_system.path
-            LOG.info(f'file_path {file_path}')
-            shop_info = get_shop_data(mall_link, user_request, file_path)
-            LOG.info(f"I found {len(shop_info)} shops")
-            LOG.info(f"shop list: {shop_info}")
-            if len(shop_info) == 0:
-                user_request = self.get_response('shop_not_found')
-                return 1, user_request
-            elif len(shop_info) > 1:
-                self.speak_dialog('more_than_one')
-                # ask for the way of selection: time, location, nothing
-                sorting_selection = self.get_response('choose_selection')
-                if sorting_selection:
-                    LOG.info(f'Users answer on sorting options: {sorting_selection}')
-                    if self.voc_match(sorting_selection, "time"):
-                        LOG.info('Time sorting selected')
-                        return self.shops_by_time_selection(shop_info)
-                    elif self.voc_match(sorting_selection, "location"):
-                        LOG.info('Location sorting selected')
-                        return self.location_selection(shop_info)
-                    elif self.voc_match(sorting_selection, "no"):
-                        LOG.info('No sorting selected. Sorting by time on default.')
-                        return self.shops_by_time_selection(shop_info)
-                    else:
-                        LOG.info('Nothing matched. Sorting by time on default.')
-                        return self.shops_by_time_selection(shop_info)
+        session.state = session.AGAIN
+        sorting_selection = self.get_response('choose_selection')
+        if sorting_selection:
+            LOG.info(f'Users answer on sorting options: {sorting_selection}')
+            if self.voc_match(sorting_selection, "time"):
+                LOG.info('Time sorting selected')
+                self.shops_by_time_selection(session.shops, session)
+            elif self.voc_match(sorting_selection, "location"):
+                LOG.info('Location sorting selected')
+                self.location_selection(session.shops, session=session)
+            elif self.voc_match(sorting_selection, "no"):
+                LOG.info('No sorting selected. Sorting by time on default.')
+                self.shops_by_time_selection(session.shops, session)
             else:
-                LOG.info(f"found shop {shop_info}")
-                self.speak_shops(shop_info)
-        return 3, None
+                LOG.info('Nothing matched. Sorting by time on default.')
+                self.shops_by_time_selection(session.shops, session)
+
+    def speak_found_shops(self, found):
+        """
+        Answers about several shops from one request
+        in one response: info of every found shop, then
+        names that weren't found. The screen shows the
+        first shop's logo with names of all found shops.
+        Args:
+            found (list): (request part, found shops) pairs
+        """
+        shops = [shop for _, found_shops in found for shop in found_shops]
+        missing = [segment for segment, found_shops in found
+                   if not found_shops]
+        with self._query_timer.span('speak'):
+            sentences = []
+            for shop in shops:
+                hours, location = shop_speech(shop, self.request_lang)
+                sentences.append(self.dialog_renderer.render(
+                    'found_shop', {"name": shop['name'], "hours": hours,
+                                   "location": location}))
+            if missing:
+                sentences.append(self.dialog_renderer.render(
+                    'shops_not_found', {"names": ', '.join(missing)}))
+            LOG.info(sentences)
+            self.speak(' '.join(sentences))
+            # every show_image() replaces the previous image
+            logo = self.mall_registry.logos.local_path(shops[0]['logo']) \
+                or shops[0]['logo']
+            names = list(dict.fromkeys(shop['name'] for shop in shops))
+            self.gui.show_image(logo, caption=', '.join(names),
+                                title=shops[0]['name'])
+
+    def fetch_shops(self, session):
+        """
+        Looks for the shop on a worker thread, so the
+        search can be cancelled and can't take longer
+        than response_budget. If the budget is exceeded
+        answers from the current cache, the refresh goes
+        on in the background. Stages of the search are
+        timed by the query's timer.
+        All shops named in the request are resolved at
+        once.
+        Args:
+            session (MallSession): current conversation,
+                                   its user_request is searched
+        Returns:
+            found (list): (request part, found shops) pairs,
+                          None if search was cancelled or
+                          there is no cache yet
+        """
+        self._query_cancel = cancel = Event()
+        mall_link, lang = session.link, session.lang
+        user_request = session.user_request
+        timer = self._query_timer
+        self._query_future = future = self._query_executor.submit(
+            timer.run, self.mall_registry.get_shop_data, mall_link, lang,
+            user_request, self.cache_ttl, batch=True)
+        deadline = time.monotonic() + self.response_budget
+        while not cancel.is_set():
+            try:
+                return future.result(
+                    timeout=max(0, min(0.1, deadline - time.monotonic())))
+            except TimeoutError:
+                if time.monotonic() >= deadline:
+                    LOG.info('Shop search is too slow, using cached shops')
+                    with timer.span('cache_fallback'):
+                        return self.mall_registry.cached_shop_data(
+                            mall_link, lang, user_request, batch=True)
+        LOG.info('Shop search cancelled')
+        future.cancel()
+        return None
+
+    def report_latency(self):
+        """
+        Emits stage durations of the finished shop query
+        as 'mall-guide.query.latency' and adds them to the
+        histograms if latency_histograms setting is on.
+        The next query gets a new timer.
+        Examples:
+            {'stages': {'language_check': 48.2, 'cache_read': 0.3,
+                        'name_match': 1.1, 'speak': 210.5},
+             'total': 260.1}
+        """
+        summary = self._query_timer.summary()
+        self._query_timer = QueryTimer()
+        if not summary['stages']:
+            return
+        LOG.info(f'Query latency {summary}')
+        if self.settings.get('latency_histograms'):
+            self._latency.add(summary)
+        self.bus.emit(Message('mall-guide.query.latency', summary))
+
+    def handle_latency_request(self, message):
+        """
+        Answers 'mall-guide.latency' with query count,
+        p50, p95 and p99 in milliseconds of every stage.
+        """
+        self.bus.emit(message.response({'stages': self._latency.report()}))
+
+    def report_cache_changes(self, mall_link, lang, summary):
+        """
+        Emits 'mall-guide.cache.changed' with shops
+        inserted, updated and deleted by a cache refresh,
+        see change_summary().
+        """
+        LOG.info(f"Mall's cache changed {summary}")
+        self.bus.emit(Message('mall-guide.cache.changed',
+                              dict(summary, mall_link=mall_link, lang=lang)))
+
+    def handle_stats_request(self, message):
+        """
+        Answers 'mall-guide.stats' with the state of every
+        mall's cache used by the skill: age, number of shops,
+        lookup hits and misses, last refresh duration and
+        last fetch error, see MallRegistry.stats().
+        """
+        registry = self.mall_registry
+        shards = set(registry.shards())
+        shards.add((self.mall_link().rstrip('/'), self.request_lang))
+        malls = [registry.stats(mall_link, lang)
+                 for mall_link, lang in sorted(shards)]
+        self.bus.emit(message.response({'malls': malls}))
+
+    def handle_refresh_request(self, message):
+        """
+        Handles 'mall-guide.refresh', rebuilds the cache of
+        the mall and language from the message data (current
+        ones by default) even if the page wasn't modified.
+        Answers with the refresh status when it is done, or
+        with an error if lang isn't a language code.
+        Examples:
+            Message('mall-guide.refresh', {'lang': 'ja'}) ->
+            Message('mall-guide.refresh.response',
+                    {'mall_link': ..., 'lang': 'ja', 'status': 200})
+        """
+        mall_link = message.data.get('mall_link') or self.mall_link()
+        lang = message.data.get('lang') or self.request_lang
+        if not valid_lang(lang):
+            LOG.info(f"Refresh request with invalid language {lang!r}")
+            self.bus.emit(message.response({
+                'mall_link': mall_link, 'lang': lang, 'status': None,
+                'error': f'Invalid language code {lang!r}'}))
+            return
+        LOG.info(f"Forced refresh of {mall_link} ({lang}) cache")
+
+        def on_done(future):
+            status = None if future.cancelled() else future.result()
+            self.bus.emit(message.response({'mall_link': mall_link,
+                                            'lang': lang,
+                                            'status': status}))
+
+        self.mall_registry.refresh(mall_link, lang,
+                                   force=True).add_done_callback(on_done)
 
     def execute(self, user_request, mall_link):
-        count = 0
+        """
+        Runs the conversation about shops turn by turn
+        until user doesn't want another shop. Each step
+        of the session's state machine moves it to the
+        next state, found shops and the resolved mall's
+        link are kept for the following turns. Stages
+        of a query are reported once its answer is
+        finished, including the selection among branches.
+        Args:
+            user_request (str): shop from user's message
+            mall_link (str): mall's link, its directory
+                             page exists for user's language
+        """
         LOG.info('Start execute')
-        while count < 3 and user_request is not None and mall_link is not None:
-            new_count, user_request = self.find_shop(user_request, mall_link)
-            count = count + new_count
-        user_request = self.start_again()
-        LOG.info(str(user_request))
-        if user_request is not None:
-            LOG.info('New execution')
-            self.execute(user_request, mall_link)
-        else:
+        if mall_link is None:
             return None
+        session = MallSession(user_request, mall_link, self.request_lang)
+        steps = {session.SEARCH: self.find_shop,
+                 session.SELECT: self.select_shops,
+                 session.AGAIN: self.start_again}
+        while session.state != session.DONE:
+            LOG.info(f'Session state {session.state}')
+            steps[session.state](session)
+            if session.state in (session.AGAIN, session.DONE):
+                self.report_latency()
+        return None
 
     def _start_mall_parser_prompt(self, message):
         if self.neon_in_request(message):
@@ -362,6 +720,9 @@ class DirectorySkill(NeonSkill):
             self.make_active()
             if message is not None:
                 LOG.info('new message'+str(message))
+                # new question replaces the search in progress
+                self._cancel_query()
+                self._query_timer = QueryTimer()
                 user_request, mall_link = self.user_request_handling(message)
                 LOG.info(mall_link)
                 if user_request is not None:
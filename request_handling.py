@@ -26,121 +26,2450 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from urllib.error import HTTPError
-import requests
-import bs4
 from neon_utils.skills.neon_skill import LOG
-import urllib.request
 
-import lingua_franca
-from lingua_franca.format import pronounce_number
-lingua_franca.load_language('en')
+import re
+import os
+import sys
+import json
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import urlparse
+
+
+class RequestHandler():
+        
+    caching_file = ''
+
+
+# (connect, read) timeouts in seconds for every request
+HTTP_TIMEOUT = (3.05, 10)
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36',
+}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Returns process-wide requests.Session used for every
+    request of the skill: keeps connections alive, retries
+    failed connections and 5xx answers with backoff.
+    Returns:
+        session (requests.Session)
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            # network stack is imported on first request only
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.request import ACCEPT_ENCODING
+            from urllib3.util.retry import Retry
+            retry = Retry(total=3, connect=3, read=2, backoff_factor=0.5,
+                          status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=frozenset(['GET', 'HEAD']),
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.headers.update(HTTP_HEADERS)
+            # includes br if brotli is installed
+            session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
+
+
+def http_request(method, url, headers=None, **kwargs):
+    """
+    Sends request through the shared session with
+    the skill's timeouts.
+    Args:
+        method (str): 'GET' or 'HEAD'
+        url (str): url
+        headers (dict): extra request headers
+    Returns:
+        response (requests.Response)
+    Raises:
+        requests.RequestException: if all retries failed
+    """
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    return get_http_session().request(method, url, headers=headers, **kwargs)
+
+
+def _request_exception():
+    import requests
+    return requests.RequestException
+
+
+_active_timer = threading.local()
+
+
+class QueryTimer:
+    """
+    Durations of the stages of one shop query.
+    Stages are timed with span() or latency_span()
+    on the threads the timer is active on.
+    Examples:
+        timer = QueryTimer()
+        with timer.span('language_check'):
+            existing_lang_check(...)
+        timer.run(get_shop_data, ...)
+        timer.summary() ->
+            {'stages': {'language_check': 12.1, 'name_match': 0.4},
+             'total': 12.5}
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def span(self, stage):
+        return _Span(self, stage)
+
+    def run(self, function, *args, **kwargs):
+        """
+        Calls the function with the timer active on the
+        current thread, so its latency_span()s are recorded
+        """
+        previous = getattr(_active_timer, 'timer', None)
+        _active_timer.timer = self
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _active_timer.timer = previous
+
+    def summary(self):
+        """
+        Returns:
+            summary (dict): milliseconds per stage and their total
+        """
+        with self._lock:
+            stages = {stage: round(seconds * 1000, 3)
+                      for stage, seconds in self.stages.items()}
+        return {'stages': stages, 'total': round(sum(stages.values()), 3)}
+
+
+class _Span:
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.timer is not None:
+            self.timer.add(self.stage, time.perf_counter() - self.start)
+
+
+def latency_span(stage):
+    """
+    Times the stage for the QueryTimer active on the
+    current thread, does nothing if there is none.
+    """
+    return _Span(getattr(_active_timer, 'timer', None), stage)
+
+
+class LatencyHistograms:
+    """
+    Histograms of stage durations of many queries
+    with fixed buckets in milliseconds.
+    Percentiles are interpolated inside the bucket.
+    """
+
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+               10000, 30000, 60000)
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, summary):
+        """
+        Adds stage durations from QueryTimer.summary()
+        """
+        with self._lock:
+            for stage, ms in list(summary['stages'].items()) + \
+                    [('total', summary['total'])]:
+                counts = self._counts.setdefault(
+                    stage, [0] * (len(self.BUCKETS) + 1))
+                counts[bisect_left(self.BUCKETS, ms)] += 1
+
+    def percentile(self, stage, p):
+        """
+        Args:
+            stage (str): stage name or 'total'
+            p (float): percentile from 0 to 100
+        Returns:
+            ms (float): None if the stage wasn't timed
+        """
+        with self._lock:
+            counts = list(self._counts.get(stage, ()))
+        total = sum(counts)
+        if not total:
+            return None
+        rank = total * p / 100
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                low = self.BUCKETS[i - 1] if i else 0
+                high = self.BUCKETS[i] if i < len(self.BUCKETS) \
+                    else self.BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return float(self.BUCKETS[-1])
+
+    def report(self):
+        """
+        Returns:
+            report (dict): count, p50, p95 and p99 per stage
+        """
+        with self._lock:
+            stages = {stage: sum(counts)
+                      for stage, counts in self._counts.items()}
+        return {stage: {'count': count,
+                        'p50': self.percentile(stage, 50),
+                        'p95': self.percentile(stage, 95),
+                        'p99': self.percentile(stage, 99)}
+                for stage, count in stages.items()}
+
+
+def normalize_name(text: str):
+    """
+    Normalizes shop name or user's request for matching:
+    lower case, no accents or apostrophes, '&' spelled
+    as 'and', other punctuation replaced by spaces.
+    Args:
+        text (str): shop name or utterance
+    Returns:
+        normalized (str)
+    Examples:
+        "Macy's  Café" -> "macys cafe"
+        "Barnes & Noble" -> "barnes and noble"
+    """
+    text = re.sub(r"['’`]", '', text).replace('&', ' and ')
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(re.findall(r'[^\W_]+', text.lower()))
+
+
+# words and punctuation between shop names in one request
+SHOP_SEPARATORS = re.compile(r'(\s*,\s*(?:and\s+)?|\s+and\s+|\s*&\s*|'
+                             r'\s+or\s+)', re.IGNORECASE)
+# longer requests are matched as one shop name
+MAX_SHOP_PARTS = 8
+
+
+def split_shop_request(user_request: str):
+    """
+    Splits user's request at words which may separate
+    shop names. Separators are kept because they may
+    be part of a name too.
+    Returns:
+        parts (list): request parts
+        separators (list): text between the parts
+    Examples:
+        "ABC Stores, Apple and Barnes & Noble" ->
+        ['ABC Stores', 'Apple', 'Barnes', 'Noble'],
+        [', ', ' and ', ' & ']
+    """
+    pieces = SHOP_SEPARATORS.split(user_request)
+    return pieces[0::2], pieces[1::2]
+
+
+_PHONETIC_RULES = [(re.compile(pattern), replacement)
+                   for pattern, replacement in (
+    (r'^(?:kn|gn|pn|wr|ps)', 'n'),
+    (r'^x', 's'),
+    (r'^wh', 'w'),
+    (r'mb$', 'm'),
+    (r'ph', 'f'),
+    (r'(?:sch|ck|q)', 'k'),
+    (r'(?:tch|sh|ch|sio|tio|cia)', 'X'),
+    (r'th', '0'),
+    (r'dg(?=[eiy])', 'j'),
+    (r'gh(?![aeiou])', ''),
+    (r'g(?=[eiy])', 'j'),
+    (r'c(?=[eiy])', 's'),
+    (r'c', 'k'),
+    (r'x', 'ks'),
+    (r'z', 's'),
+    (r'v', 'f'),
+    (r'd', 't'),
+    (r'(?<=[^aeiou])h|h(?![aeiou])', ''),
+    (r'[wy](?![aeiou])', ''),
+)]
+
+
+@lru_cache(maxsize=None)
+def phonetic_key(word: str):
+    """
+    Returns Metaphone-like key of a normalized word,
+    words that sound alike get the same key.
+    Examples:
+        "macys", "macies" -> "ms"
+        "sephora", "sefora" -> "sfr"
+    """
+    if not word or word.isdigit():
+        return word
+    key = word
+    for pattern, replacement in _PHONETIC_RULES:
+        key = pattern.sub(replacement, key)
+    # vowels are kept only at the start of the word
+    key = key[:1] + re.sub(r'[aeiouy]', '', key[1:])
+    return re.sub(r'(.)\1+', r'\1', key).lower()
+
+
+def edit_distance(a: str, b: str):
+    """
+    Returns Levenshtein distance between the strings
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def similarity(a: str, b: str):
+    """
+    Returns 1 - edit distance relative to the longer string
+    """
+    longest = max(len(a), len(b))
+    return 1 - edit_distance(a, b) / longest if longest else 1.0
+
+
+class ShopNameIndex:
+    """
+    Prebuilt index over shop names. Names are normalized
+    once, their tokens are kept in an inverted index and
+    in a sorted list for prefix lookups, so a query only
+    touches names sharing a token (or token prefix) with
+    it instead of scanning every key.
+    Phonetic keys of the tokens are indexed as well, so
+    names misheard by STT are still found by sound or
+    edit distance when nothing matches them literally.
+    Args:
+        names (iterable): shop names (cache keys)
+    """
+
+    # shortest query token used for prefix matching
+    min_prefix = 2
+    # names scored per query, the ones sharing most tokens with it
+    max_candidates = 200
+    # score of names found by sound or spelling only, times similarity
+    fuzzy_weight = 0.75
+    # names compared by edit distance per query
+    max_fuzzy_candidates = 50
+
+    def __init__(self, names=()):
+        self._normalized = {}
+        self._names = {}
+        self._lengths = {}
+        self._postings = {}
+        self._keys = {}
+        self._key_postings = {}
+        self._tokens = []
+        for name in names:
+            self._add(name)
+        self._tokens = sorted(self._postings)
+
+    def __len__(self):
+        return len(self._normalized)
+
+    def _add(self, name, copy=False):
+        normalized = normalize_name(name)
+        tokens = normalized.split()
+        keys = [phonetic_key(token) for token in tokens]
+        self._normalized[name] = normalized
+        # tuples, so copies of the index can share them
+        self._names[normalized] = self._names.get(normalized, ()) + (name,)
+        self._lengths[name] = len(normalized)
+        self._keys[name] = ''.join(keys)
+        for postings, terms in ((self._postings, tokens),
+                                (self._key_postings, keys)):
+            for term in set(terms):
+                if copy:
+                    postings[term] = postings.get(term, set()) | {name}
+                else:
+                    postings.setdefault(term, set()).add(name)
+
+    def _remove(self, name):
+        normalized = self._normalized.pop(name, None)
+        if normalized is None:
+            return
+        names = tuple(other for other in self._names[normalized]
+                      if other != name)
+        if names:
+            self._names[normalized] = names
+        else:
+            del self._names[normalized]
+        del self._lengths[name]
+        tokens = normalized.split()
+        keys = [phonetic_key(token) for token in tokens]
+        del self._keys[name]
+        for postings, terms in ((self._postings, tokens),
+                                (self._key_postings, keys)):
+            for term in set(terms):
+                names = postings[term] - {name}
+                if names:
+                    postings[term] = names
+                else:
+                    del postings[term]
+
+    def _candidates(self, tokens):
+        candidates = Counter()
+        for token in set(tokens):
+            matched = set(self._postings.get(token, ()))
+            if len(token) >= self.min_prefix:
+                i = bisect_left(self._tokens, token)
+                while i < len(self._tokens) and \
+                        self._tokens[i].startswith(token):
+                    matched.update(self._postings[self._tokens[i]])
+                    i += 1
+            candidates.update(matched)
+        return candidates
+
+    def _top_candidates(self, candidates, limit):
+        """
+        Keeps limit names sharing most tokens with
+        the request, shorter names first among equals.
+        """
+        if len(candidates) <= limit:
+            return candidates
+        # hits of the last kept name, there are few distinct hits
+        kept = 0
+        for cutoff, count in sorted(Counter(candidates.values()).items(),
+                                    reverse=True):
+            kept += count
+            if kept >= limit:
+                break
+        top = {name: hits for name, hits in candidates.items()
+               if hits > cutoff}
+        room = limit - len(top)
+        lengths = self._lengths
+        tied = sorted([name for name, hits in candidates.items()
+                       if hits == cutoff], key=lengths.__getitem__)
+        # names as long as the last kept one are taken in
+        # alphabetical order, so every process keeps the same
+        longest = lengths[tied[room - 1]]
+        shorter = [name for name in tied[:room] if lengths[name] < longest]
+        same = sorted(name for name in tied if lengths[name] == longest)
+        for name in shorter + same[:room - len(shorter)]:
+            top[name] = cutoff
+        return top
+
+    def _fuzzy_scores(self, query, tokens):
+        """
+        Scores names with tokens sounding like the query's
+        tokens or sharing their first three letters by the
+        similarity of their phonetic keys or spelling. Only
+        max_fuzzy_candidates names matching most of the
+        query's tokens are compared.
+        """
+        keys = [phonetic_key(token) for token in tokens]
+        candidates = Counter()
+        for token, key in set(zip(tokens, keys)):
+            matched = set(self._key_postings.get(key, ()))
+            if len(token) >= 3:
+                prefix = token[:3]
+                i = bisect_left(self._tokens, prefix)
+                while i < len(self._tokens) and \
+                        self._tokens[i].startswith(prefix):
+                    matched.update(self._postings[self._tokens[i]])
+                    i += 1
+            candidates.update(matched)
+        query_key = ''.join(keys)
+        return {name: self.fuzzy_weight *
+                max(similarity(query_key, self._keys[name]),
+                    similarity(query, self._normalized[name]))
+                for name in self._top_candidates(candidates,
+                                                 self.max_fuzzy_candidates)}
+
+    def _exact_matches(self, query, tokens):
+        """
+        Scores names equal to the request or to a run
+        of its words, they are looked up directly and
+        no other name scores as high.
+        """
+        scores = {}
+        for name in self._names.get(query, ()):
+            scores[name] = 1.0
+        for size in range(len(tokens) - 1, 0, -1):
+            for i in range(len(tokens) - size + 1):
+                phrase = ' '.join(tokens[i:i + size])
+                for name in self._names.get(phrase, ()):
+                    scores.setdefault(name, 0.9)
+        return [(score, name) for name, score in scores.items()]
+
+    def search(self, user_request: str, limit: int = 5):
+        """
+        Scores shop names against user's request.
+        Exact match scores 1.0, name contained in the
+        request 0.9, request contained in the name 0.5-0.9
+        (whole words score higher than word parts),
+        partial token overlap below 0.5. If no name scores
+        0.5, names sounding or spelled alike score up to
+        fuzzy_weight.
+        Only max_candidates names sharing most tokens with
+        the request (shorter names first) are scored.
+        Args:
+            user_request (str): shop from user's message
+            limit (int): max number of candidates
+        Returns:
+            candidates (list): (score, name) sorted by score,
+                               ties broken by name
+        """
+        query = normalize_name(user_request)
+        tokens = query.split()
+        if not tokens:
+            return []
+        scored = self._exact_matches(query, tokens)
+        if len(scored) >= limit:
+            scored.sort(key=lambda item: (-item[0], item[1]))
+            return scored[:limit]
+        candidates = self._top_candidates(self._candidates(tokens),
+                                          self.max_candidates)
+        padded_query = f' {query} '
+        scored = []
+        for name, hits in candidates.items():
+            normalized = self._normalized[name]
+            if not normalized:
+                continue
+            if normalized == query:
+                score = 1.0
+            elif f' {normalized} ' in padded_query:
+                score = 0.9
+            elif padded_query in f' {normalized} ':
+                score = 0.6 + 0.3 * len(query) / len(normalized)
+            elif query in normalized:
+                score = 0.5 + 0.2 * len(query) / len(normalized)
+            else:
+                score = 0.5 * min(hits, len(normalized.split())) / \
+                    max(len(tokens), len(normalized.split()))
+            scored.append((score, name))
+        if not scored or max(scored)[0] < 0.5:
+            scores = dict((name, score) for score, name in scored)
+            for name, score in self._fuzzy_scores(query, tokens).items():
+                scores[name] = max(score, scores.get(name, 0))
+            scored = [(score, name) for name, score in scores.items()]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return scored[:limit]
+
+    def with_changes(self, added=(), removed=()):
+        """
+        Returns a new index with names added and removed,
+        only the changed names are normalized again. This
+        index isn't modified, so it can still be searched
+        meanwhile.
+        Args:
+            added (iterable): new shop names
+            removed (iterable): names no longer in the cache
+        Returns:
+            ShopNameIndex
+        """
+        index = ShopNameIndex()
+        index._normalized = dict(self._normalized)
+        index._names = dict(self._names)
+        index._lengths = dict(self._lengths)
+        index._postings = dict(self._postings)
+        index._keys = dict(self._keys)
+        index._key_postings = dict(self._key_postings)
+        for name in removed:
+            index._remove(name)
+        for name in added:
+            index._add(name, copy=True)
+        index._tokens = sorted(index._postings)
+        return index
+
+    def best_match(self, user_request: str, min_score: float = 0.5):
+        """
+        Returns the best scoring shop name or None
+        if no name reaches min_score.
+        """
+        candidates = self.search(user_request, limit=1)
+        if candidates and candidates[0][0] >= min_score:
+            return candidates[0][1]
+        return None
+
+    def resolve(self, user_request: str, min_score: float = 0.5):
+        """
+        Finds all shops named in user's request. Tries
+        every way to join the parts from split_shop_request()
+        and keeps the one where the parts match names best,
+        so "Barnes & Noble" stays one name while
+        "ABC Stores and Apple" are two.
+        Args:
+            user_request (str): shops from user's message
+            min_score (float): see best_match()
+        Returns:
+            matches (list): (request part, shop name or None)
+                            in the request's order, every
+                            name only once
+        Examples:
+            'abc stores and apple' ->
+            [('abc stores', 'ABC Stores'), ('apple', 'Apple')]
+        """
+        parts, separators = split_shop_request(user_request)
+        if len(parts) > MAX_SHOP_PARTS:
+            return [(user_request, self.best_match(user_request, min_score))]
+        # best[i] is (value, matches) of the first i parts,
+        # a matched part adds its score over min_score
+        best = [(0.0, [])]
+        for i in range(1, len(parts) + 1):
+            best.append(None)
+            for j in range(i):
+                segment = parts[j]
+                for k in range(j + 1, i):
+                    segment += separators[k - 1] + parts[k]
+                segment = segment.strip()
+                value, matches = best[j]
+                if segment:
+                    candidates = self.search(segment, limit=1)
+                    score, name = candidates[0] if candidates else (0, None)
+                    if score < min_score:
+                        score, name = min_score, None
+                    value += score - min_score
+                    matches = matches + [(segment, name)]
+                if best[i] is None or value > best[i][0]:
+                    best[i] = (value, matches)
+        seen = set()
+        matches = []
+        for segment, name in best[-1][1]:
+            if name is None or name not in seen:
+                seen.add(name)
+                matches.append((segment, name))
+        return matches
+
+
+class Tenant:
+    """
+    Compact record of one shop with a slot per field
+    instead of a dict. Text fields repeated across
+    shops (chain names, hours, locations) are interned,
+    working hours are minutes since midnight and floor
+    is a number. Supports the dict operations used on
+    shop records, compares equal to the dict with the
+    same fields and is serialized to it, see to_dict().
+    Args:
+        name, hours, location, logo (str): fields from the
+                                           mall's page
+    Examples:
+        shop = Tenant('ABC Stores', '9am – 9pm', 'Street Level 1')
+        shop['name'] -> 'ABC Stores'
+        shop.get('opens') -> None
+        shop == {'name': 'ABC Stores', 'hours': '9am – 9pm',
+                 'location': 'Street Level 1', 'logo': None} -> True
+    """
+
+    __slots__ = ('name', 'hours', 'location', 'logo', 'opens', 'closes',
+                 'floor', 'spoken_hours', 'spoken_location')
+
+    _fields = frozenset(__slots__)
+    _interned = frozenset(('name', 'hours', 'location', 'spoken_hours',
+                           'spoken_location'))
+    _numbers = frozenset(('opens', 'closes', 'floor'))
+
+    def __init__(self, name, hours, location, logo=None):
+        self['name'] = name
+        self['hours'] = hours
+        self['location'] = location
+        self['logo'] = logo
+
+    @classmethod
+    def from_dict(cls, record):
+        """
+        Returns Tenant with the fields of the record,
+        records are returned as they are.
+        """
+        if isinstance(record, cls):
+            return record
+        tenant = cls.__new__(cls)
+        for key in cls.__slots__:
+            if key in record:
+                tenant[key] = record[key]
+        return tenant
+
+    def to_dict(self):
+        """
+        Returns fields in the cache file's format
+        """
+        return {key: getattr(self, key) for key in self.keys()}
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        if value is not None:
+            if key in self._interned:
+                value = sys.intern(value)
+            elif key in self._numbers:
+                value = int(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fields and hasattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Tenant):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Tenant({self.to_dict()!r})'
+
+
+def tenant_to_json(obj):
+    """
+    json default= hook writing Tenants as dicts
+    """
+    if isinstance(obj, Tenant):
+        return obj.to_dict()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+def tenants_from_json(shop_cache):
+    """
+    Returns cache read from JSON with Tenant records
+    Args:
+        shop_cache (dict): shop name -> list of shop dicts
+    """
+    return {name: [Tenant.from_dict(shop) for shop in shops]
+            for name, shops in shop_cache.items()}
+
+
+class DirectorySnapshot:
+    """
+    Shops of one loaded cache with the indexes built
+    from them. A snapshot isn't changed after it is
+    built, ShopDirectory replaces the whole snapshot
+    with one assignment, so readers holding it never
+    see the data of one cache with indexes of another.
+    Args:
+        data (dict): shop name -> list of shops
+        index (ShopNameIndex): index of data's names
+        shops (list): shop of every row of hours, None
+                      for rows of removed shops
+        hours (tuple): opens, closes arrays, see
+                       shop_hours_arrays(), or None
+        rows (dict): id of every shop -> its row
+    """
+
+    __slots__ = ('data', 'index', 'shops', 'hours', 'rows')
+
+    def __init__(self, data, index, shops, hours, rows):
+        self.data = data
+        self.index = index
+        self.shops = shops
+        self.hours = hours
+        self.rows = rows
+
+    @classmethod
+    def build(cls, data, index=None):
+        """
+        Builds snapshot of data with all its indexes,
+        the name index only if it isn't given.
+        """
+        shops = [shop for shops in data.values() for shop in shops]
+        return cls(data,
+                   ShopNameIndex(data.keys()) if index is None else index,
+                   shops, shop_hours_arrays(shops) if shops else None,
+                   {id(shop): row for row, shop in enumerate(shops)})
+
+    def with_changes(self, data, removed, added):
+        """
+        Returns snapshot of data, this snapshot's cache
+        updated by diff_shop_cache(). Only names and rows
+        of removed and added shops are changed: rows of
+        removed shops are left empty, added shops get new
+        rows at the end. Built again from data when half
+        of the rows would be empty or a removed shop isn't
+        in this snapshot.
+        Args:
+            data (dict): updated cache
+            removed (list): shop records no longer in data
+            added (list): new shop records of data
+        Returns:
+            DirectorySnapshot
+        """
+        old, new = self.data.keys(), data.keys()
+        index = self.index.with_changes(new - old, old - new)
+        rows = dict(self.rows)
+        try:
+            freed = [rows.pop(id(shop)) for shop in removed]
+        except KeyError:
+            return DirectorySnapshot.build(data, index)
+        size = len(self.shops) + len(added)
+        if self.hours is None or 2 * (len(rows) + len(added)) < size:
+            return DirectorySnapshot.build(data, index)
+        import numpy as np
+        shops = list(self.shops)
+        opens, closes = (hours.copy() for hours in self.hours)
+        for row in freed:
+            shops[row] = None
+        opens[freed] = closes[freed] = -1
+        for row, shop in enumerate(added, len(shops)):
+            rows[id(shop)] = row
+        shops.extend(added)
+        if added:
+            added_opens, added_closes = shop_hours_arrays(added)
+            opens = np.concatenate((opens, added_opens))
+            closes = np.concatenate((closes, added_closes))
+        return DirectorySnapshot(data, index, shops, (opens, closes), rows)
+
+
+class ShopDirectory:
+    """
+    In-memory view of one cached_stores.json file.
+    The file is read once and kept resident; it is
+    re-read only when its mtime or size changes or
+    when new data is loaded after a refresh.
+    Args:
+        caching_file (str): path to cached_stores.json
+    """
+
+    def __init__(self, caching_file):
+        self.caching_file = caching_file
+        self._snapshot = DirectorySnapshot({}, ShopNameIndex(), [], None,
+                                           {})
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.caching_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def exists(self):
+        return self._file_stamp() is not None
+
+    def age(self):
+        """
+        Returns seconds since the cache file was written
+        or None if there is no cache file.
+        """
+        try:
+            return time.time() - os.path.getmtime(self.caching_file)
+        except OSError:
+            return None
+
+    def snapshot(self):
+        """
+        Returns the current DirectorySnapshot, re-reading
+        the file only if it was changed on disk. Lookups
+        take it once and use only it.
+        """
+        stamp = self._file_stamp()
+        if stamp is not None and stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    self._read(stamp)
+        return self._snapshot
+
+    @property
+    def data(self):
+        """
+        Returns cached shops, re-reading the file
+        only if it was changed on disk.
+        """
+        return self.snapshot().data
+
+    def _read(self, stamp):
+        with open(self.caching_file, 'r', encoding='utf-8') as readfile:
+            data = tenants_from_json(json.load(readfile))
+        self._snapshot = DirectorySnapshot.build(data)
+        self._stamp = stamp
+        LOG.info(f'Loaded {len(data)} shops from {self.caching_file}')
+
+    def load(self, data):
+        """
+        Replaces resident data with freshly built
+        cache, e.g. right after it was written to disk.
+        Args:
+            data (dict): shop name -> list of shops
+        """
+        with self._lock:
+            self._snapshot = DirectorySnapshot.build(data)
+            self._stamp = self._file_stamp()
+
+    def update(self, data, changes):
+        """
+        Replaces resident data with the cache updated by
+        a refresh. The name index and hours are only
+        updated for changed shops, see
+        DirectorySnapshot.with_changes().
+        Args:
+            data (dict): shop name -> list of shops
+            changes (dict): from diff_shop_cache()
+        """
+        with self._lock:
+            if self._stamp is None:
+                self._snapshot = DirectorySnapshot.build(data)
+            else:
+                self._snapshot = self._snapshot.with_changes(
+                    data, changes['removed'], changes['added'])
+            self._stamp = self._file_stamp()
+
+    def touch(self):
+        """
+        Marks the cache file as fresh without
+        re-reading it, e.g. when the mall page
+        wasn't modified since the last download.
+        """
+        with self._lock:
+            stamp = self._file_stamp()
+            os.utime(self.caching_file)
+            if stamp is not None and stamp == self._stamp:
+                self._stamp = self._file_stamp()
+
+    def invalidate(self):
+        """
+        Forces the next access to re-read the file.
+        """
+        with self._lock:
+            self._stamp = None
+
+    def find(self, user_request: str):
+        """
+        Returns list of shops with the name matching
+        user's request or None.
+        """
+        snapshot = self.snapshot()
+        store_name = snapshot.index.best_match(user_request)
+        LOG.info(f'found key {store_name}')
+        if store_name is not None:
+            LOG.info(f'Shop exists {snapshot.data[store_name]}')
+            return snapshot.data[store_name]
+        LOG.info("Shop doesn't exist in cache")
+        return None
+
+    def find_all(self, user_request: str):
+        """
+        Finds all shops named in user's request
+        in one pass over the name index.
+        Returns:
+            found (list): (request part, list of shops),
+                          see ShopNameIndex.resolve()
+        """
+        snapshot = self.snapshot()
+        return [(segment, snapshot.data[name] if name is not None else [])
+                for segment, name in snapshot.index.resolve(user_request)]
+
+    def search(self, user_request: str, limit: int = 5):
+        """
+        Returns scored candidate names, see ShopNameIndex.search
+        """
+        return self.snapshot().index.search(user_request, limit)
+
+    def open_now(self, minutes=None):
+        """
+        Returns all shops of the directory open at the
+        given time with one vectorized comparison.
+        Args:
+            minutes (int): minutes since midnight,
+                           current time by default
+        Returns:
+            open_shops (list)
+        """
+        snapshot = self.snapshot()
+        if minutes is None:
+            minutes = current_minutes()
+        if not snapshot.shops:
+            return []
+        mask = open_mask(*snapshot.hours, minutes)
+        return [snapshot.shops[i] for i in mask.nonzero()[0]]
+
+
+_directories = {}
+_directories_lock = threading.Lock()
+
+
+def get_directory(file_path):
+    """
+    Returns process-wide ShopDirectory for the cache
+    stored in file_path, creating it on first use.
+    Args:
+        file_path (str): directory with cached_stores.json
+    Returns:
+        ShopDirectory
+    """
+    caching_file = file_path+'/cached_stores.json'
+    directory = _directories.get(caching_file)
+    if directory is None:
+        with _directories_lock:
+            directory = _directories.setdefault(caching_file,
+                                                ShopDirectory(caching_file))
+    return directory
+
+class SQLiteShopStore:
+    """
+    Optional SQLite backend for the mall's cache.
+    Shops are stored one per row with indexed floor
+    and working hours columns and an FTS5 index over
+    normalized name and location, so a lookup reads only the
+    matching rows instead of the whole cache file.
+    Args:
+        db_file (str): database path
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS shops (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            search_name TEXT NOT NULL,
+            location TEXT,
+            floor INTEGER,
+            opens INTEGER,
+            closes INTEGER,
+            record TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS shops_name ON shops (name);
+        CREATE INDEX IF NOT EXISTS shops_floor ON shops (floor);
+        CREATE INDEX IF NOT EXISTS shops_hours ON shops (opens, closes);
+    """
+    _fts_schema = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS shops_fts USING fts5(
+            search_name, location, content='shops', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._name_index = None
+        self.has_fts = True
+        with self._connection() as connection:
+            connection.executescript(self._schema)
+            try:
+                connection.executescript(self._fts_schema)
+            except sqlite3.OperationalError:
+                LOG.info('SQLite has no FTS5, searching shop names by index')
+                self.has_fts = False
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_file, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM shops').fetchone()[0]
+
+    @staticmethod
+    def _row(shop):
+        return (shop['name'], normalize_name(shop['name']),
+                shop.get('location'), shop_floor(shop), *shop_hours(shop),
+                json.dumps(shop, ensure_ascii=False, default=tenant_to_json))
+
+    def write(self, shop_cache):
+        """
+        Replaces stored shops in one transaction,
+        readers see either old or new shops.
+        Args:
+            shop_cache (dict): shop name -> list of shops
+        """
+        rows = [self._row(shop)
+                for shops in shop_cache.values() for shop in shops]
+        with self._write_lock, self._connection() as connection:
+            connection.execute('DELETE FROM shops')
+            connection.executemany(
+                'INSERT INTO shops (name, search_name, location, floor, '
+                'opens, closes, record) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            if self.has_fts:
+                connection.execute(
+                    "INSERT INTO shops_fts (shops_fts) VALUES ('rebuild')")
+        self._name_index = None
+
+    def apply(self, removed, added):
+        """
+        Deletes and inserts only the changed shops in
+        one transaction, the full-text index is updated
+        for these rows only.
+        Args:
+            removed (list): shop records to delete
+            added (list): shop records to insert
+        Returns:
+            bool: False if a removed shop isn't stored,
+                  nothing is changed then
+        """
+        with self._write_lock, self._connection() as connection:
+            for shop in removed:
+                row = connection.execute(
+                    'SELECT id, search_name, location FROM shops '
+                    'WHERE name = ? AND record = ? LIMIT 1',
+                    (shop['name'], json.dumps(shop, ensure_ascii=False,
+                                              default=tenant_to_json))
+                ).fetchone()
+                if row is None:
+                    connection.rollback()
+                    return False
+                connection.execute('DELETE FROM shops WHERE id = ?',
+                                   (row[0],))
+                if self.has_fts:
+                    connection.execute(
+                        "INSERT INTO shops_fts (shops_fts, rowid, "
+                        "search_name, location) VALUES ('delete', ?, ?, ?)",
+                        row)
+            for shop in added:
+                row = self._row(shop)
+                rowid = connection.execute(
+                    'INSERT INTO shops (name, search_name, location, floor, '
+                    'opens, closes, record) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    row).lastrowid
+                if self.has_fts:
+                    connection.execute(
+                        'INSERT INTO shops_fts (rowid, search_name, '
+                        'location) VALUES (?, ?, ?)',
+                        (rowid, row[1], row[2]))
+        self._name_index = None
+        return True
+
+    def _records(self, query, params=()):
+        return [Tenant.from_dict(json.loads(row[0])) for row in
+                self._connection().execute(query, params)]
+
+    def names(self, user_request: str, limit: int = 50):
+        """
+        Returns names of shops sharing a word
+        (or word prefix) with user's request.
+        """
+        tokens = normalize_name(user_request).split()
+        if not tokens:
+            return []
+        if self.has_fts:
+            match = ' OR '.join(f'"{token}"*' for token in tokens)
+            query = 'SELECT DISTINCT shops.name FROM shops_fts ' \
+                    'JOIN shops ON shops.id = shops_fts.rowid ' \
+                    'WHERE shops_fts.search_name MATCH ? ' \
+                    'ORDER BY bm25(shops_fts) LIMIT ?'
+            params = (match, limit)
+        else:
+            query = 'SELECT DISTINCT name FROM shops WHERE ' + \
+                    ' OR '.join('search_name LIKE ?' for _ in tokens) + \
+                    ' LIMIT ?'
+            params = (*(f'%{token}%' for token in tokens), limit)
+        return [row[0] for row in
+                self._connection().execute(query, params)]
+
+    def name_index(self):
+        """
+        Returns ShopNameIndex of all stored names for
+        requests the full-text index can't match, like
+        names misheard by STT. Built on first use after
+        every write.
+        """
+        index = self._name_index
+        if index is None:
+            index = self._name_index = ShopNameIndex(
+                row[0] for row in self._connection().execute(
+                    'SELECT DISTINCT name FROM shops'))
+        return index
+
+    def find(self, user_request: str):
+        """
+        Returns list of shops with the name matching
+        user's request or None. Candidates come from
+        the full-text index and are ranked like in
+        ShopDirectory.find().
+        """
+        store_name = ShopNameIndex(self.names(user_request)).\
+            best_match(user_request) or \
+            self.name_index().best_match(user_request)
+        LOG.info(f'found key {store_name}')
+        if store_name is None:
+            return None
+        return self._records('SELECT record FROM shops WHERE name = ? '
+                             'ORDER BY id', (store_name,))
+
+    def find_all(self, user_request: str):
+        """
+        Finds all shops named in user's request, names
+        are resolved among full-text candidates of the
+        whole request, see ShopNameIndex.resolve().
+        Returns:
+            found (list): (request part, list of shops)
+        """
+        matches = ShopNameIndex(self.names(user_request)).\
+            resolve(user_request)
+        if any(name is None for _, name in matches):
+            matches = self.name_index().resolve(user_request)
+        return [(segment, self._records(
+                    'SELECT record FROM shops WHERE name = ? ORDER BY id',
+                    (name,)) if name is not None else [])
+                for segment, name in matches]
+
+    def _select(self, condition, params, names=None):
+        query = f'SELECT record FROM shops WHERE {condition}'
+        if names is not None:
+            names = list(names)
+            query += ' AND name IN ({})'.format(
+                ', '.join(f':name{i}' for i in range(len(names))))
+            params = dict(params, **{f'name{i}': name
+                                     for i, name in enumerate(names)})
+        return self._records(query + ' ORDER BY id', params)
+
+    def shops_on_floor(self, floor, names=None):
+        """
+        Returns shops on the floor by the floor index.
+        Args:
+            floor (int): floor number
+            names (iterable): only shops with these names
+        """
+        return self._select('floor = :floor', {'floor': floor}, names)
+
+    def open_now(self, minutes=None, names=None):
+        """
+        Returns shops open at the given time by the
+        hours index, see open_mask() for the interval rules.
+        Args:
+            minutes (int): minutes since midnight,
+                           current time by default
+            names (iterable): only shops with these names
+        """
+        if minutes is None:
+            minutes = current_minutes()
+        return self._select(
+            'opens >= 0 AND ((opens <= :t AND :t < closes) OR '
+            '(closes <= opens AND (:t >= opens OR :t < closes)))',
+            {'t': minutes}, names)
+
+
+_stores = {}
+
+
+def get_store(file_path):
+    """
+    Returns process-wide SQLiteShopStore of the cache
+    in file_path. If the database doesn't exist yet it
+    is filled from cached_stores.json.
+    """
+    db_file = file_path+'/cached_stores.db'
+    with _directories_lock:
+        store = _stores.get(db_file)
+        if store is not None:
+            return store
+        new_database = not os.path.isfile(db_file)
+        store = _stores[db_file] = SQLiteShopStore(db_file)
+    directory = get_directory(file_path)
+    if new_database and directory.exists():
+        store.write(directory.data)
+    return store
+
+
+
+class CacheStats:
+    """
+    Counters of one mall's cache: lookups found or
+    missed in find_cached_stores() and results of
+    background refreshes.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failed_refreshes = 0
+        self.last_refresh = None
+        self.last_refresh_seconds = None
+        self.last_status = None
+        self.last_error = None
+        self.last_error_time = None
+        self.last_changes = None
+        self._lock = threading.Lock()
+
+    def count_lookup(self, found):
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_refresh(self, status, seconds, error=None):
+        """
+        Args:
+            status (int): status returned by caching_stores_in_mall()
+            seconds (float): refresh duration
+            error (str): reason the refresh failed, None on success
+        """
+        with self._lock:
+            self.refreshes += 1
+            self.last_refresh = time.time()
+            self.last_refresh_seconds = round(seconds, 3)
+            self.last_status = status
+            if error is not None:
+                self.failed_refreshes += 1
+                self.last_error = error
+                self.last_error_time = self.last_refresh
+
+    def record_changes(self, summary):
+        """
+        Args:
+            summary (dict): from change_summary()
+        """
+        with self._lock:
+            self.last_changes = summary
+
+    def as_dict(self):
+        """
+        Returns:
+            stats (dict): all counters and hit ratio
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': self.hits / lookups if lookups else None,
+                    'refreshes': self.refreshes,
+                    'failed_refreshes': self.failed_refreshes,
+                    'last_refresh': self.last_refresh,
+                    'last_refresh_seconds': self.last_refresh_seconds,
+                    'last_status': self.last_status,
+                    'last_error': self.last_error,
+                    'last_error_time': self.last_error_time,
+                    'last_changes': self.last_changes}
+
+
+_cache_stats = {}
+
+
+def get_cache_stats(file_path):
+    """
+    Returns process-wide CacheStats of the cache
+    in file_path, creating it on first use.
+    """
+    with _directories_lock:
+        stats = _cache_stats.get(file_path)
+        if stats is None:
+            stats = _cache_stats[file_path] = CacheStats()
+        return stats
+
+
+def find_cached_stores(user_request: str, url, file_path, backend='json',
+                       lang='en', batch=False):
+    """
+    Check shop name existence in cache keys
+    Args:
+        user_request (str): shop from user's message
+        backend (str): 'json' or 'sqlite' cache storage
+        lang (str): language of the mall's page
+        batch (bool): find every shop named in the request,
+                      see ShopDirectory.find_all()
+    Returns:
+        if file is empty -> None, {}
+        if shop wasn't found -> None, read data
+        if shop found ->  store_info (list), read data
+        if batch -> list of (request part, store_info), read data
+    Examples:
+        [
+        {"name": "ABS stores", "time": "8am-10pm", "location": "1 level"},
+        {"name": "ABS stores", "time": "8am-10pm", "location": "2 level"}
+        ]
+    """
+    directory = get_directory(file_path)
+    if not directory.exists():
+        LOG.info("Cache file doesn't exist")
+        # waits for the warm-up if it is already building the cache
+        try:
+            with latency_span('scrape'):
+                refresh_cache_in_background(file_path, url, backend,
+                                            lang).result()
+        except CancelledError:
+            return None, {}
+        if not directory.exists():
+            return None, {}
+    source = get_store(file_path) if backend == 'sqlite' else directory
+    data = {}
+    if backend != 'sqlite':
+        with latency_span('cache_read'):
+            data = directory.data
+    stats = get_cache_stats(file_path)
+    with latency_span('name_match'):
+        if batch:
+            found = source.find_all(user_request)
+            for _, shops in found:
+                stats.count_lookup(shops)
+            return found, data
+        found = source.find(user_request)
+    stats.count_lookup(found)
+    return found, data
+
+def caching_stores_in_mall(file_path, url, backend='json', lang='en',
+                           cancel=None, force=False):
+    """
+    Creates caching file in the current class.
+    Creates empty dictionary for cache. Parses
+    all shops info. Creates dict key from shop
+    name. Value list of dicts with current shop
+    info.
+    If shop name already exists in created dict
+        append current shop dict to existing 
+        list.
+    Writes created dict to created JSON file
+    and to SQLite database if it is the backend.
+    If there is a cache already, only new, changed
+    and removed shops are applied to it, see
+    diff_shop_cache().
+    Args:
+        file_path (str): new file path
+        url (str): malls url
+        backend (str): 'json' or 'sqlite' cache storage
+        lang (str): language of the mall's page
+        cancel (Event): stops the refresh when set
+        force (bool): download the page and rebuild the whole
+                      cache even if the page wasn't modified
+                      since the last refresh
+    Returns:
+        status (int): HTTP status of the page, 304 if
+                      cache is up to date, None if the
+                      page couldn't be downloaded or
+                      refresh was cancelled
+    Examples:
+        {"ABS stores": [
+        {"name": "ABS stores", "time": "8am-10pm", "location": "1 level"},
+        {"name": "ABS stores", "time": "8am-10pm", "location": "2 level"}
+        ]}
+    """
+    caching_file = file_path+'/cached_stores.json'
+    LOG.info(f'caching_file {caching_file}')
+    directory = get_directory(file_path)
+    validators = read_cache_validators(file_path, url) \
+        if directory.exists() and not force else None
+    status, page, validators = fetch_page(url, validators)
+    if status == 304:
+        directory.touch()
+        LOG.info("Mall's cache is up to date")
+        return status
+    if page is None:
+        LOG.info("Mall's cache wasn't updated")
+        return status
+    if cancel is not None and cancel.is_set():
+        LOG.info("Mall's cache refresh cancelled")
+        return None
+    tenants = extract_tenants(page)
+    if directory.exists() and not force:
+        shop_cache, changes = diff_shop_cache(directory.data, tenants, lang)
+    else:
+        shop_cache, changes = build_shop_cache(tenants, lang), None
+    if cancel is not None and cancel.is_set():
+        LOG.info("Mall's cache refresh cancelled")
+        return None
+    summary = change_summary(changes, shop_cache)
+    if changes is not None and not changes['added'] \
+            and not changes['removed']:
+        write_cache_file(file_path+'/cached_stores.meta.json',
+                         dict(validators, url=url))
+        directory.touch()
+        get_cache_stats(file_path).record_changes(summary)
+        LOG.info("Mall's shops weren't changed")
+        return status
+    if backend == 'sqlite':
+        store = get_store(file_path)
+        if changes is None or \
+                not store.apply(changes['removed'], changes['added']):
+            store.write(shop_cache)
+    write_cache_file(caching_file, shop_cache)
+    write_cache_file(file_path+'/cached_stores.meta.json',
+                     dict(validators, url=url))
+    if changes is None:
+        directory.load(shop_cache)
+        LOG.info("Created mall's cache")
+    else:
+        directory.update(shop_cache, changes)
+        LOG.info(f"Updated mall's cache: {summary}")
+    get_cache_stats(file_path).record_changes(summary)
+    return status
+
+
+def _class_selector(class_name, first=True):
+    from lxml import etree
+    xpath = f".//*[contains(concat(' ', normalize-space(@class), ' '), " \
+            f"' {class_name} ')]"
+    return etree.XPath(f'({xpath})[1]' if first else xpath)
+
+
+@lru_cache(maxsize=None)
+def _tenant_selectors():
+    # compiled on the first page extraction, lxml isn't
+    # imported until the cache is refreshed
+    from lxml import etree
+    return {
+        'cards': _class_selector('directory-tenant-card', first=False),
+        'text': etree.XPath('.//text()'),
+        'logo': etree.XPath('(.//img)[1]/@src'),
+        'info': _class_selector('tenant-info-container'),
+        'name': _class_selector('tenant-info-row'),
+        'hours': _class_selector('tenant-hours-container'),
+        'location': _class_selector('tenant-location-container'),
+    }
+
+
+def _element_text(element):
+    # Same as BeautifulSoup's .text: whitespace-only strings
+    # collapse to a single newline or space
+    strings = []
+    for string in _tenant_selectors()['text'](element):
+        if not string.strip(' \t\n\r\f'):
+            string = '\n' if '\n' in string else ' '
+        strings.append(string)
+    return ''.join(strings)
+
+
+def _decode_page(page):
+    if isinstance(page, str):
+        return page
+    try:
+        return page.decode('utf-8')
+    except UnicodeDecodeError:
+        import bs4
+        return bs4.UnicodeDammit(page, is_html=True).unicode_markup
+
+
+def extract_tenants(page):
+    """
+    Extracts shops from the mall's directory page.
+    Only tenant cards are visited, each field is read
+    from the card's own subtree with precompiled XPath.
+    Args:
+        page (bytes|str): directory page html
+    Returns:
+        tenants (list): shop dicts in page order
+    Examples:
+        [{"name": "ABC Stores", "hours": "9am – 9pm",
+          "location": "Street Level 1", "logo": "https://..."}]
+    """
+    def text(element):
+        return _element_text(element[0]) if element else ''
+
+    import lxml.html
+    select = _tenant_selectors()
+    tree = lxml.html.document_fromstring(_decode_page(page))
+    tenants = []
+    for card in select['cards'](tree):
+        logo = select['logo'](card)
+        info = select['info'](card)
+        info = info[0] if info else card
+        tenants.append(Tenant(
+            text(select['name'](info)).strip().strip('\n'),
+            text(select['hours'](info)).strip('\n'),
+            text(select['location'](info)).strip('\n'),
+            str(logo[0]) if logo else None))
+    return tenants
+
+
+def read_cache_validators(file_path, url):
+    """
+    Reads ETag and Last-Modified headers stored
+    with the cache of the url.
+    Args:
+        file_path (str): directory with cached_stores.json
+        url (str): malls url
+    Returns:
+        validators (dict): may be empty
+    """
+    try:
+        with open(file_path+'/cached_stores.meta.json', 'r',
+                  encoding='utf-8') as readfile:
+            meta = json.load(readfile)
+    except (OSError, ValueError):
+        return {}
+    if meta.get('url') != url:
+        return {}
+    return meta
+
+
+def build_shop_cache(tenants, lang='en'):
+    """
+    Groups extracted shops by name and adds fields
+    precomputed for the dialogs:
+        opens, closes (int): working hours in minutes
+                             since midnight or None
+        floor (int): floor number from location or None
+        spoken_hours, spoken_location (str): speech-ready
+                             hours and location
+    Args:
+        tenants (list): shops from extract_tenants()
+        lang (str): language of the spoken fields
+    Returns:
+        shop_cache (dict): shop name -> list of Tenants
+    """
+    shop_cache = {}
+    for shop_data in tenants:
+        shop_data = build_tenant(shop_data, lang)
+        name = shop_data['name']
+        if name in shop_cache.keys():
+            shop_cache[name].append(shop_data)
+        else:
+            shop_cache[name] = [shop_data]
+    return shop_cache
+
+
+def build_tenant(shop, lang='en'):
+    """
+    Returns Tenant of the extracted shop with the
+    fields precomputed for the dialogs, see
+    build_shop_cache()
+    """
+    shop_data = Tenant.from_dict(shop)
+    shop_data['opens'], shop_data['closes'] = \
+        parse_hours(shop_data['hours'])
+    shop_data['floor'] = extract_floor(shop_data['location'])
+    shop_data['spoken_hours'] = spoken_hours(shop_data)
+    shop_data['spoken_location'] = \
+        location_format(shop_data['location'], lang)
+    return shop_data
+
+
+# fields of a shop on the mall's page, derived fields aren't fingerprinted
+TENANT_FIELDS = ('name', 'hours', 'location', 'logo')
+# shop names listed per kind of change in change summaries
+CHANGED_NAMES_LIMIT = 20
+
+
+def tenant_fingerprint(shop):
+    """
+    Returns hash of the shop's fields scraped from the
+    mall's page, equal for unchanged shops.
+    """
+    fields = '\x1f'.join(str(shop.get(field) or '')
+                         for field in TENANT_FIELDS)
+    return hashlib.sha1(fields.encode('utf-8')).hexdigest()
+
+
+def diff_shop_cache(shop_cache, tenants, lang='en'):
+    """
+    Updates existing shop cache with freshly extracted
+    shops. Shops are matched by fingerprint, unchanged
+    ones keep their cached records, only new and changed
+    shops go through build_tenant(). A shop with the
+    same name and location but other hours or logo is
+    an update, any other unmatched shop is an insert or
+    a delete.
+    Args:
+        shop_cache (dict): existing cache, shop name -> list of shops
+        tenants (list): shops from extract_tenants()
+        lang (str): language of the spoken fields
+    Returns:
+        shop_cache (dict): new cache in the page's order
+        changes (dict): 'added' and 'removed' records and
+                        'inserted', 'updated', 'deleted'
+                        shop names and 'unchanged' count
+    """
+    by_fingerprint = {}
+    for shops in shop_cache.values():
+        for shop in shops:
+            by_fingerprint.setdefault(tenant_fingerprint(shop),
+                                      []).append(shop)
+    records = [None] * len(tenants)
+    pending = []
+    for i, tenant in enumerate(tenants):
+        matches = by_fingerprint.get(tenant_fingerprint(tenant))
+        if matches:
+            records[i] = matches.pop(0)
+        else:
+            pending.append(i)
+    by_location = {}
+    for shops in by_fingerprint.values():
+        for shop in shops:
+            by_location.setdefault((shop['name'], shop['location']),
+                                   []).append(shop)
+    changes = {'added': [], 'removed': [], 'inserted': [], 'updated': [],
+               'deleted': [], 'unchanged': len(tenants) - len(pending)}
+    for i in pending:
+        tenant = records[i] = build_tenant(tenants[i], lang)
+        matches = by_location.get((tenant['name'], tenant['location']))
+        if matches:
+            changes['removed'].append(matches.pop(0))
+            changes['updated'].append(tenant['name'])
+        else:
+            changes['inserted'].append(tenant['name'])
+        changes['added'].append(tenant)
+    for shops in by_location.values():
+        changes['removed'].extend(shops)
+        changes['deleted'].extend(shop['name'] for shop in shops)
+    new_cache = {}
+    for shop in records:
+        new_cache.setdefault(shop['name'], []).append(shop)
+    return new_cache, changes
+
+
+def change_summary(changes, shop_cache):
+    """
+    Returns counts and some names of changed shops
+    Args:
+        changes (dict): from diff_shop_cache(),
+                        None for a full rebuild
+        shop_cache (dict): new cache
+    Examples:
+        {'incremental': True, 'inserted': 1, 'updated': 2,
+         'deleted': 0, 'unchanged': 350,
+         'names': {'inserted': ['Apple'], 'updated': [...],
+                   'deleted': []}}
+    """
+    if changes is None:
+        return {'incremental': False,
+                'inserted': sum(len(shops) for shops in shop_cache.values()),
+                'updated': 0, 'deleted': 0, 'unchanged': 0, 'names': {}}
+    kinds = ('inserted', 'updated', 'deleted')
+    summary = {kind: len(changes[kind]) for kind in kinds}
+    summary.update(incremental=True, unchanged=changes['unchanged'],
+                   names={kind: changes[kind][:CHANGED_NAMES_LIMIT]
+                          for kind in kinds})
+    return summary
+
+
+def write_cache_file(caching_file, data):
+    """
+    Writes data to a temporary file next to caching_file
+    and renames it over caching_file, so readers see
+    either the old or the new cache, never a partial one.
+    Args:
+        caching_file (str): target file path
+        data (dict): JSON serializable data, Tenants
+                     are written as dicts
+    """
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(caching_file),
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as outfile:
+            json.dump(data, outfile, ensure_ascii=False,
+                      default=tenant_to_json)
+        os.chmod(tmp_file, 0o666)
+        os.replace(tmp_file, caching_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+# max number of malls refreshed at the same time
+REFRESH_WORKERS = 4
 
-import re
-import os
-import json
+_refresh_executor = None
+_refreshing = {}
+_refreshing_lock = threading.Lock()
 
-from datetime import datetime
 
+def get_refresh_executor():
+    """
+    Returns process-wide bounded thread pool
+    running cache refreshes of all malls.
+    """
+    global _refresh_executor
+    with _refreshing_lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(
+                max_workers=REFRESH_WORKERS,
+                thread_name_prefix='mall-cache-refresh')
+        return _refresh_executor
 
-class RequestHandler():
-        
-    caching_file = ''
 
-def find_cached_stores(user_request: str, url, file_path):
+def refresh_cache_in_background(file_path, url, backend='json', lang='en',
+                                force=False, on_done=None):
     """
-    Check shop name existence in cache keys
+    Rebuilds mall's cache in the refresh thread pool
+    while the existing cache keeps being served.
+    Only one refresh per cache runs at a time, it
+    can be stopped with cancel_refresh(). A refresh
+    being cancelled is never returned, a new one is
+    started instead. A forced refresh doesn't join a
+    running one that may end as 304, it is queued to
+    rebuild the cache after it.
     Args:
-        user_request (str): shop from user's message
+        file_path (str): directory with cached_stores.json
+        url (str): malls url
+        backend (str): 'json' or 'sqlite' cache storage
+        lang (str): language of the mall's page
+        force (bool): rebuild even if the page wasn't modified
+        on_done (callable): called with the future when a newly
+                            started refresh finishes, it isn't
+                            added to a running refresh
     Returns:
-        if file is empty -> None, {}
-        if shop wasn't found -> None, read data
-        if shop found ->  store_info (list), read data
-    Examples:
-        [
-        {"name": "ABS stores", "time": "8am-10pm", "location": "1 level"},
-        {"name": "ABS stores", "time": "8am-10pm", "location": "2 level"}
-        ]
+        future (Future): resolves to the status returned
+                         by caching_stores_in_mall()
     """
-    caching_file = file_path+'/cached_stores.json'
-    if os.path.isfile(caching_file) == False:
-        LOG.info("Cache file doesn't exist")
-        caching_stores_in_mall(file_path, url)
-        return find_cached_stores(user_request, url, file_path)
-    else:
-        with open(caching_file, 'r', encoding='utf-8') as readfile:
-            data = json.load(readfile)
-            found_key = [key for key in data.keys() 
-                            if key.lower() in user_request.lower() 
-                                or user_request.lower() in key.lower()]
-            LOG.info(f'found key {found_key}')
-            if len(found_key) >=1 :
-                store_name = str(found_key[0])
-                LOG.info(f'Shop exists {data[store_name]}')
-                return data[store_name], data
-            else:
-                LOG.info("Shop doesn't exist in cache")
-                return None, data
+    executor = get_refresh_executor()
+    with _refreshing_lock:
+        running = _refreshing.get(file_path)
+        if running is not None and (running.done() or
+                                    running.cancel_event.is_set()):
+            running = None
+        if running is not None and (running.forced or not force):
+            return running
+        cancel = threading.Event()
+        if running is None:
+            future = executor.submit(_refresh_cache, file_path, url,
+                                     backend, lang, cancel, force)
+        else:
+            future = executor.submit(_refresh_after, running, file_path,
+                                     url, backend, lang, cancel, force)
+        future.cancel_event = cancel
+        future.forced = force
+        _refreshing[file_path] = future
+    if on_done is not None:
+        future.add_done_callback(on_done)
+    return future
+
 
-def caching_stores_in_mall(file_path, url):
+def cancel_refresh(file_path):
     """
-    Creates caching file in the current class.
-    Creates empty dictionary for cache. Parses
-    all shops info. Creates dict key from shop
-    name. Value list of dicts with current shop
-    info.
-    If shop name already exists in created dict
-        append current shop dict to existing 
-        list.
-    Writes created dict to created JSON file.
+    Cancels the running refresh of the cache in file_path.
+    A refresh that wasn't started yet is dropped, a running
+    one stops before parsing or writing the cache.
+    Returns:
+        bool: True if there was a refresh to cancel
+    """
+    with _refreshing_lock:
+        future = _refreshing.get(file_path)
+    if future is None or future.done():
+        return False
+    future.cancel_event.set()
+    future.cancel()
+    return True
+
+
+def _refresh_after(previous, *args):
+    """
+    Runs _refresh_cache() once the previous
+    refresh of the same cache is finished
+    """
+    wait([previous])
+    return _refresh_cache(*args)
+
+
+def _refresh_cache(file_path, url, backend, lang, cancel, force=False):
+    start = time.monotonic()
+    status, error = None, None
+    try:
+        status = caching_stores_in_mall(file_path, url, backend, lang,
+                                        cancel, force)
+        if status is None and not cancel.is_set():
+            error = f'Failed to download {url}'
+        elif status is not None and status not in (200, 304):
+            error = f'HTTP {status} from {url}'
+        return status
+    except Exception as e:
+        LOG.error(f"Mall's cache refresh failed: {e}")
+        error = f'{type(e).__name__}: {e}'
+    finally:
+        if not cancel.is_set():
+            get_cache_stats(file_path).record_refresh(
+                status, time.monotonic() - start, error)
+
+
+# parallel logo downloads during a refresh
+LOGO_WORKERS = 8
+
+
+class LogoCache:
+    """
+    Shop logos stored in the skill's file system,
+    so the GUI shows a local file instead of fetching
+    the image from the mall's storage on every answer.
+    Files are named by the logo url hash, a logo is
+    never downloaded twice. Least recently shown
+    logos are removed when the cache exceeds max_bytes.
     Args:
-        file_path (str): new file path
-        url (str): malls url
+        cache_dir (str): logos directory
+        max_bytes (int): disk usage limit
+    """
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._fetching = set()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, url):
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if not re.fullmatch(r'\.[a-z0-9]{1,5}', extension):
+            extension = '.img'
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + extension)
+
+    def local_path(self, url):
+        """
+        Returns local file of the logo and marks it
+        as recently used, None if it isn't cached.
+        """
+        if not url:
+            return None
+        path = self.path_for(url)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def fetch(self, url):
+        """
+        Downloads the logo if it isn't cached yet.
+        Returns:
+            path (str): local file or None if download failed
+        """
+        path = self.path_for(url)
+        if os.path.isfile(path):
+            return path
+        with self._lock:
+            if url in self._fetching:
+                return None
+            self._fetching.add(url)
+        try:
+            response = http_request('GET', url)
+            if response.status_code != 200:
+                LOG.info(f'Logo not downloaded {response.status_code}: {url}')
+                return None
+            fd, tmp_file = tempfile.mkstemp(dir=self.cache_dir,
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'wb') as outfile:
+                outfile.write(response.content)
+            os.replace(tmp_file, path)
+            return path
+        except (_request_exception(), OSError) as e:
+            LOG.info(f'Logo not downloaded {e}: {url}')
+            return None
+        finally:
+            with self._lock:
+                self._fetching.discard(url)
+
+    def prefetch(self, urls):
+        """
+        Downloads missing logos in parallel and
+        evicts old ones if the cache is too big.
+        Args:
+            urls (iterable): logo urls
+        Returns:
+            downloaded (int): number of cached logos
+        """
+        missing = {url for url in urls
+                   if url and not os.path.isfile(self.path_for(url))}
+        if missing:
+            with ThreadPoolExecutor(max_workers=LOGO_WORKERS,
+                                    thread_name_prefix='mall-logos') as pool:
+                downloaded = sum(1 for path in pool.map(self.fetch, missing)
+                                 if path)
+            LOG.info(f'Downloaded {downloaded} of {len(missing)} logos')
+        else:
+            downloaded = 0
+        self.evict()
+        return downloaded
+
+    def evict(self):
+        """
+        Removes least recently used logos until the
+        cache fits into max_bytes.
+        """
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+class MallRegistry:
+    """
+    Cache shards of many malls, one per mall url and
+    language, stored under file_path/malls/. Every
+    shard has its own cached_stores.json so changing
+    the mall or the language never serves another
+    directory's shops.
+    Args:
+        file_path (str): skill's file system path
+        backend (str): 'json' or 'sqlite' cache storage
+    Attributes:
+        on_change (callable): called with mall link, language
+                              and change_summary() after a
+                              refresh changed the shard
+    """
+
+    def __init__(self, file_path, backend='json'):
+        self.file_path = file_path
+        self.backend = backend
+        self.on_change = None
+        self.languages = get_language_cache(file_path)
+        self.logos = LogoCache(os.path.join(file_path, 'logos'))
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def directory_link(mall_link, lang):
+        """
+        Returns mall's directory page url for the language
+        Examples:
+            'https://www.alamoanacenter.com', 'en' ->
+            'https://www.alamoanacenter.com/en/directory/'
+        """
+        return mall_link.rstrip('/')+'/'+lang+'/directory/'
+
+    def shard_path(self, mall_link, lang):
+        """
+        Returns directory of the cache shard,
+        creating it on first use.
+        Args:
+            mall_link (str): mall's url
+            lang (str): language in ISO 639-1
+        Returns:
+            path (str)
+        Raises:
+            ValueError: if lang isn't a language code
+        """
+        key = (mall_link.rstrip('/'), lang)
+        path = self._shards.get(key)
+        if path is None:
+            if not valid_lang(lang):
+                raise ValueError(f'Invalid language code {lang!r}')
+            parsed = urlparse(key[0])
+            slug = re.sub(r'[^\w.-]+', '_',
+                          parsed.netloc+parsed.path).strip('_')
+            digest = hashlib.sha1(key[0].encode('utf-8')).hexdigest()[:8]
+            path = os.path.join(self.file_path, 'malls',
+                                f'{slug}-{digest}', lang)
+            os.makedirs(path, exist_ok=True)
+            with self._lock:
+                self._shards[key] = path
+        return path
+
+    def shards(self):
+        """
+        Returns (mall url, language) pairs of
+        all shards used by this process.
+        """
+        return list(self._shards)
+
+    def directory(self, mall_link, lang):
+        return get_directory(self.shard_path(mall_link, lang))
+
+    def store(self, mall_link, lang):
+        """
+        Returns SQLiteShopStore of the shard if it is
+        the backend, None for the JSON backend.
+        """
+        if self.backend != 'sqlite':
+            return None
+        return get_store(self.shard_path(mall_link, lang))
+
+    def refresh(self, mall_link, lang, force=False):
+        """
+        Starts background refresh of the shard.
+        A successful page download also marks
+        the language as available and prefetches
+        new logos.
+        Args:
+            force (bool): rebuild even if the page wasn't modified
+        Returns:
+            future (Future): see refresh_cache_in_background()
+        """
+        link = self.directory_link(mall_link, lang)
+
+        def on_done(future):
+            if future.cancelled():
+                return
+            if future.result() in (200, 304):
+                self.languages.set(link, True)
+            if future.result() == 200:
+                self.prefetch_logos(mall_link, lang)
+                changes = get_cache_stats(path).last_changes
+                if self.on_change is not None and changes:
+                    self.on_change(mall_link, lang, changes)
+
+        path = self.shard_path(mall_link, lang)
+        return refresh_cache_in_background(path, link, self.backend, lang,
+                                           force, on_done)
+
+    def stats(self, mall_link, lang):
+        """
+        Returns state of the shard's cache
+        Examples:
+            {'mall_link': 'https://www.alamoanacenter.com/',
+             'lang': 'en', 'backend': 'json', 'age': 3600.5,
+             'shops': 352, 'names': 340, 'refreshing': False,
+             'hits': 12, 'misses': 3, 'hit_ratio': 0.8, ...}
+        """
+        path = self.shard_path(mall_link, lang)
+        directory = get_directory(path)
+        data = directory.data if directory.exists() else {}
+        with _refreshing_lock:
+            future = _refreshing.get(path)
+        stats = {'mall_link': mall_link, 'lang': lang,
+                 'backend': self.backend, 'age': directory.age(),
+                 'shops': sum(len(shops) for shops in data.values()),
+                 'names': len(data),
+                 'refreshing': future is not None and not future.done()}
+        stats.update(get_cache_stats(path).as_dict())
+        return stats
+
+    def prefetch_logos(self, mall_link, lang):
+        """
+        Downloads logos of the shard's shops in the
+        background.
+        Returns:
+            future (Future): resolves to LogoCache.prefetch() result
+        """
+        directory = self.directory(mall_link, lang)
+        urls = [shop.get('logo') for shops in directory.data.values()
+                for shop in shops]
+        return get_refresh_executor().submit(self.logos.prefetch, urls)
+
+    def warm_up(self, mall_link, lang, cache_ttl=None):
+        """
+        Builds the shard's cache if it is missing or older
+        than cache_ttl and loads it with its indexes, so the
+        first query doesn't wait for them. Blocks until done,
+        queries started meanwhile wait for the same refresh.
+        Args:
+            mall_link (str): mall's url
+            lang (str): language in ISO 639-1
+            cache_ttl (float): cache lifetime in seconds
+        Returns:
+            bool: True if the shard has a cache
+        """
+        directory = self.directory(mall_link, lang)
+        age = directory.age()
+        if age is None or (cache_ttl and age > cache_ttl):
+            LOG.info(f'Warming up cache of {mall_link} ({lang})')
+            try:
+                self.refresh(mall_link, lang).result()
+            except CancelledError:
+                return False
+        if not directory.exists():
+            return False
+        directory.data  # reads the file and builds the indexes
+        self.store(mall_link, lang)
+        floor_forms(lang=lang)
+        return True
+
+    def cancel(self, mall_link, lang):
+        """
+        Cancels running refresh of the shard, see cancel_refresh()
+        """
+        return cancel_refresh(self.shard_path(mall_link, lang))
+
+    def cached_shop_data(self, mall_link, lang, user_request, batch=False):
+        """
+        Looks the shop up in the shard's current cache
+        only, never refreshes or downloads anything.
+        Returns:
+            found_shops (list): None if the shard has no cache yet
+        """
+        directory = self.directory(mall_link, lang)
+        if not directory.exists():
+            return None
+        if batch:
+            return directory.find_all(user_request)
+        return directory.find(user_request) or []
+
+    def get_shop_data(self, mall_link, lang, user_request, cache_ttl=None,
+                      batch=False):
+        """
+        get_shop_data() on the shard of the mall and
+        language, stale shard is refreshed in the background.
+        """
+        directory = self.directory(mall_link, lang)
+        age = directory.age()
+        if cache_ttl and age is not None and age > cache_ttl:
+            LOG.info(f"Mall's cache is {int(age)}s old, refreshing")
+            self.refresh(mall_link, lang)
+        shops = get_shop_data(self.directory_link(mall_link, lang),
+                              user_request,
+                              self.shard_path(mall_link, lang),
+                              backend=self.backend, lang=lang, batch=batch)
+        if age is None and directory.exists():
+            # the cache was just built for this request
+            self.prefetch_logos(mall_link, lang)
+        return shops
+
+
+_LANG_CODE = re.compile(r'[a-z]{2,3}')
+
+
+def valid_lang(lang):
+    """
+    Checks that lang is an ISO 639 code, so it is
+    safe to use as a directory name
     Examples:
-        {"ABS stores": [
-        {"name": "ABS stores", "time": "8am-10pm", "location": "1 level"},
-        {"name": "ABS stores", "time": "8am-10pm", "location": "2 level"}
-        ]}
+        'en' -> True
+        '../../x' -> False
     """
-    caching_file = file_path+'/cached_stores.json'
-    LOG.info(f'caching_file {caching_file}')
-    shop_cache = {}
-    soup = parse(url)
-    for shop in soup.find_all(attrs={"class": "directory-tenant-card"}):
-            logo = shop.find_next("img").get('src')
-            info = shop.find_next(attrs={"class": "tenant-info-container"})
-            name = info.find_next(attrs={"class": "tenant-info-row"}).text.strip().strip('\n')
-            hours = info.find_next(attrs={"class": "tenant-hours-container"}).text.strip('\n')
-            location = info.find_next(attrs={"tenant-location-container"}).text.strip('\n')
-            shop_data = {'name': name, 'hours': hours, 'location': location, 'logo': logo}
-            if name in shop_cache.keys():
-                shop_cache[name].append(shop_data)                
-            else:
-                shop_cache[name] = [shop_data]
-    with open(caching_file,
-                                'w+') as outfile:
-        json.dump(shop_cache, outfile, ensure_ascii=False)
-    os.chmod(caching_file, 777)
-    LOG.info("Created mall's cache")
+    return isinstance(lang, str) and _LANG_CODE.fullmatch(lang) is not None
+
+
+_registries = {}
+
+
+def get_mall_registry(file_path):
+    """
+    Returns process-wide MallRegistry stored in
+    file_path, creating it on first use.
+    """
+    with _directories_lock:
+        registry = _registries.get(file_path)
+    if registry is None:
+        registry = MallRegistry(file_path)
+        with _directories_lock:
+            registry = _registries.setdefault(file_path, registry)
+    return registry
+
+
+class MallSession:
+    """
+    State of one conversation about the mall's shops,
+    kept across turns by DirectorySkill.execute().
+    Args:
+        user_request (str): shop from user's message
+        link (str): mall's link, shops are searched in
+                    its directory page for lang
+        lang (str): user's language in ISO 639-1
+    Attributes:
+        state (str): next step of the conversation:
+                     SEARCH a shop, SELECT among found
+                     shops, ask AGAIN for another one or DONE
+        shops (list): last found shops, follow-up questions
+                      like "which one is open?" select among them
+        attempts (int): searches of the current shop
+                        that found nothing
+    """
+
+    __slots__ = ('state', 'user_request', 'link', 'lang', 'shops',
+                 'attempts')
 
-def existing_lang_check(user_lang: str, url):
+    SEARCH = 'search'
+    SELECT = 'select'
+    AGAIN = 'again'
+    DONE = 'done'
+
+    # searches of one shop before asking for another one
+    max_attempts = 3
+
+    def __init__(self, user_request, link, lang):
+        self.link = link
+        self.lang = lang
+        self.shops = []
+        self.new_request(user_request)
+
+    def new_request(self, user_request):
+        """
+        Starts search of another shop
+        """
+        self.user_request = user_request
+        self.attempts = 0
+        self.state = self.SEARCH if user_request else self.AGAIN
+
+
+def existing_lang_check(user_lang: str, url, file_path=None):
     """
     Check existence of user's language
-    on the mall web-page
+    on the mall web-page.
+    If file_path is given the answer is taken from
+    the persistent language cache, expired entries
+    are re-checked in the background. Only the very
+    first check of the language makes a request.
     Args:
         user_lang (str): user's lang in ISO 639-1
+        url (str): malls url
+        file_path (str): directory for the language cache
     Returns:
         bool: True if lang exists
     """
     link = url+user_lang+'/directory/'
-    response = requests.get(link)
-    if response.status_code == 200:
+    if file_path is None:
+        found = probe_directory_link(link)
+    else:
+        cache = get_language_cache(file_path)
+        found = cache.get(link)
+        if found is None:
+            found = probe_directory_link(link)
+            if found is not None:
+                cache.set(link, found)
+        elif cache.expired(link):
+            cache.refresh_in_background(link)
+    if found:
         LOG.info('This language is supported')
         return True, link
     else:
         LOG.info('This language is not supported')
         return False, link
 
+
+def probe_directory_link(link):
+    """
+    Checks that the mall's directory page exists
+    without downloading it (HEAD request). Falls
+    back to GET if HEAD isn't allowed.
+    Args:
+        link (str): directory page url
+    Returns:
+        bool: True if page exists, None if the
+              check failed
+    """
+    try:
+        response = http_request('HEAD', link, allow_redirects=True)
+        if response.status_code in (405, 501):
+            response = http_request('GET', link)
+    except _request_exception() as e:
+        LOG.info(f'Language check failed: {e}')
+        return None
+    return response.status_code == 200
+
+
+class LanguageAvailability:
+    """
+    Persistent cache of language checks, keyed
+    by the directory link of mall and language.
+    Supported languages are re-checked after
+    positive_ttl, missing ones after negative_ttl.
+    Args:
+        cache_file (str): JSON file path
+    """
+
+    positive_ttl = 7 * 24 * 3600
+    negative_ttl = 3600
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._probing = set()
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as readfile:
+                self._entries = json.load(readfile)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, link):
+        """
+        Returns cached availability of the link
+        or None if it was never checked.
+        """
+        entry = self._entries.get(link)
+        return None if entry is None else entry['available']
+
+    def expired(self, link):
+        entry = self._entries.get(link)
+        if entry is None:
+            return True
+        ttl = self.positive_ttl if entry['available'] else self.negative_ttl
+        return time.time() - entry['checked'] > ttl
+
+    def set(self, link, available):
+        """
+        Stores availability of the link, writing the file
+        only if the value changed or the entry expired.
+        """
+        if self.get(link) == available and not self.expired(link):
+            return
+        with self._lock:
+            self._entries[link] = {'available': available,
+                                   'checked': time.time()}
+            try:
+                write_cache_file(self.cache_file, self._entries)
+            except OSError as e:
+                LOG.error(f"Language cache wasn't saved: {e}")
+
+    def refresh_in_background(self, link):
+        with self._lock:
+            if link in self._probing:
+                return
+            self._probing.add(link)
+        threading.Thread(target=self._refresh, args=(link,),
+                         name='mall-lang-check', daemon=True).start()
+
+    def _refresh(self, link):
+        try:
+            available = probe_directory_link(link)
+            if available is not None:
+                self.set(link, available)
+        finally:
+            with self._lock:
+                self._probing.discard(link)
+
+
+_language_caches = {}
+
+
+def get_language_cache(file_path):
+    """
+    Returns process-wide LanguageAvailability stored
+    in file_path, creating it on first use.
+    """
+    cache_file = file_path+'/languages.json'
+    with _directories_lock:
+        cache = _language_caches.get(cache_file)
+        if cache is None:
+            cache = _language_caches[cache_file] = \
+                LanguageAvailability(cache_file)
+    return cache
+
 def curent_time_extraction():
     """
     Defines current time in utc timezone
@@ -161,13 +2490,202 @@ def curent_time_extraction():
     hour, min = int(exact_time[0]), int(exact_time[1])
     return day_time, hour, min
 
-def location_format(location):
+_CLOCK_TIME = re.compile(r'(\d{1,2})(?:[:.](\d{2}))?\s*([ap])\.?\s*m\b',
+                         re.IGNORECASE)
+
+
+def parse_hours(hours: str):
+    """
+    Parses shop's working hours into minutes
+    since midnight. A shop closing when it opens
+    is open 24 hours.
+    Args:
+        hours (str): hours from the mall page
+    Returns:
+        opens, closes (int, int): None, None if hours
+                                  can't be parsed
+    Examples:
+        '9am – 9pm' -> 540, 1260
+        '10:30am - 12am' -> 630, 0
+        'Open 24 hours' -> 0, 1440
+        '12am – 12am' -> 0, 1440
+    """
+    times = _CLOCK_TIME.findall(hours or '')
+    if len(times) >= 2:
+        opens, closes = (clock_minutes(part_of_day.lower()+'m', int(hour),
+                                       int(minute or 0))
+                         for hour, minute, part_of_day in times[:2])
+        if opens == closes:
+            return 0, 24 * 60
+        return opens, closes
+    if '24' in (hours or '') and 'hour' in hours.lower():
+        return 0, 24 * 60
+    return None, None
+
+
+def clock_minutes(part_of_day, hour, min):
+    """
+    Converts 12-hour clock time to minutes since midnight.
+    Args:
+        part_of_day (str): 'am' or 'pm'
+        hour (int): 1-12
+        min (int): 0-59
+    Returns:
+        minutes (int)
+    Examples:
+        'pm', 9, 15 -> 1275
+        'am', 12, 0 -> 0
+    """
+    return (hour % 12 + (12 if part_of_day == 'pm' else 0)) * 60 + min
+
+
+def current_minutes():
+    """
+    Returns current time in minutes since midnight
+    """
+    day_time, hour, min = curent_time_extraction()
+    return clock_minutes(day_time[1], hour, min)
+
+
+def format_clock(minutes):
+    """
+    Formats minutes since midnight for pronunciation.
+    Examples:
+        540 -> '9 A M'
+        1290 -> '9 30 P M'
+    """
+    hour, min = divmod(int(minutes) % (24 * 60), 60)
+    part_of_day = 'A M' if hour < 12 else 'P M'
+    hour = hour % 12 or 12
+    return f'{hour} {min:02d} {part_of_day}' if min else \
+        f'{hour} {part_of_day}'
+
+
+def shop_hours(shop):
+    """
+    Returns precomputed working hours of the shop,
+    parses them for shops cached without hours.
+    Returns:
+        opens, closes (int, int): minutes since midnight
+    """
+    if 'opens' in shop:
+        return shop['opens'], shop['closes']
+    return parse_hours(shop['hours'])
+
+
+def shop_hours_arrays(shops):
+    """
+    Collects working hours of the shops into
+    arrays, unknown hours are stored as -1.
+    Args:
+        shops (list): shops' info
+    Returns:
+        opens, closes (numpy.ndarray, numpy.ndarray)
+    """
+    import numpy as np
+    hours = [shop_hours(shop) for shop in shops]
+    opens = np.array([-1 if o is None else o for o, _ in hours],
+                     dtype=np.int16)
+    closes = np.array([-1 if c is None else c for _, c in hours],
+                      dtype=np.int16)
+    return opens, closes
+
+
+def open_mask(opens, closes, minutes):
+    """
+    Evaluates which shops are open at the given time.
+    Shops closing after midnight (closes <= opens) are
+    open from opens till midnight and from midnight
+    till closes.
+    Args:
+        opens (numpy.ndarray): opening minutes
+        closes (numpy.ndarray): closing minutes
+        minutes (int): minutes since midnight
+    Returns:
+        mask (numpy.ndarray): True for open shops
+    """
+    known = opens >= 0
+    same_day = (opens <= minutes) & (minutes < closes)
+    overnight = (closes <= opens) & ((minutes >= opens) | (minutes < closes))
+    return known & (same_day | overnight)
+
+
+def open_all_day(opens, closes):
+    """
+    Evaluates which shops never close, parse_hours()
+    stores 'Open 24 hours' and '12am – 12am' as 0, 1440.
+    Args:
+        opens (numpy.ndarray): opening minutes
+        closes (numpy.ndarray): closing minutes
+    Returns:
+        mask (numpy.ndarray): True for shops open 24 hours
+    """
+    return (opens >= 0) & (closes.astype('int32') - opens >= 24 * 60)
+
+
+def minutes_until(targets, minutes):
+    """
+    Returns minutes left from the given time till
+    each target time, wrapping over midnight.
+    Args:
+        targets (numpy.ndarray): minutes since midnight
+        minutes (int): minutes since midnight
+    Returns:
+        left (numpy.ndarray)
+    """
+    return (targets.astype('int32') - minutes) % (24 * 60)
+
+
+_loaded_languages = set()
+_language_lock = threading.Lock()
+
+
+def load_language(lang):
+    """
+    Loads lingua_franca resources of the language
+    once, on the first number that is pronounced.
+    Returns:
+        bool: False if the language isn't supported
+    """
+    if lang in _loaded_languages:
+        return True
+    with _language_lock:
+        if lang not in _loaded_languages:
+            import lingua_franca
+            try:
+                lingua_franca.load_language(lang)
+            except Exception as e:
+                LOG.info(f"Numbers can't be pronounced in {lang}: {e}")
+                return False
+            _loaded_languages.add(lang)
+    return True
+
+
+def spoken_number(number, lang='en', ordinals=False):
+    """
+    Pronounces the number in the language,
+    falls back to digits if it isn't supported.
+    Examples:
+        2 -> 'two'
+        2, ordinals=True -> 'second'
+    """
+    if not load_language(lang):
+        return str(number)
+    from lingua_franca.format import pronounce_number
+    try:
+        return pronounce_number(number, lang=lang, ordinals=ordinals)
+    except Exception:
+        return str(number)
+
+
+def location_format(location, lang='en'):
     """
     Finds all digits in store's location and
     formats them to numeral words.
     Args:
         location (str): location info
         from shops info
+        lang (str): language of numeral words
     Returns:
         if digits were found:
             pronounced (str): utterance with
@@ -177,57 +2695,210 @@ def location_format(location):
     Examples:
         'level 1' -> 'level one'
     """
-    floor = re.findall(r'\d+', location)
-    if len(floor) > 0:
-        floor = floor[0]
-        num = pronounce_number(int(floor), ordinals=False)
-        pronounced = re.sub(r'\d+', num, location)
-        return pronounced
-    else:
-        return location
+    return re.sub(r'\d+',
+                  lambda number: spoken_number(int(number.group()), lang),
+                  location)
+
+
+def spoken_hours(shop):
+    """
+    Formats shop's working hours for pronunciation.
+    Returns:
+        hours (str)
+    Examples:
+        '9am – 10:30pm' -> 'from 9 A M to 10 30 P M'
+        'Open 24 hours' -> 'open 24 hours'
+    """
+    opens, closes = shop_hours(shop)
+    if opens is None:
+        return re.sub(r'(\d+)am.+(\d+)pm', r'from \1 A M to \2 P M',
+                      shop['hours'])
+    if closes - opens >= 24 * 60:
+        return 'open 24 hours'
+    return f'from {format_clock(opens)} to {format_clock(closes)}'
+
+
+def shop_speech(shop, lang='en'):
+    """
+    Returns speech-ready hours and location of
+    the shop, precomputed when the cache was built.
+    Returns:
+        hours, location (str, str)
+    """
+    if 'spoken_hours' in shop:
+        return shop['spoken_hours'], shop['spoken_location']
+    return spoken_hours(shop), location_format(shop['location'], lang)
 
-def shop_selection_by_floors(user_request, found_shops):
+def shop_selection_by_floors(user_request, found_shops, lang='en',
+                             store=None):
     """
     If there are several shops in found shops list
     and user agrees to select shop by floor.
-    Finds all digits in store's location and
-    formats them to ordinal and cardinal numerals.
-    Matches formated numerals with user's request.
-    If shop was found appends it to the new found
-    list.
+    Resolves the floor from user's answer with
+    resolve_floor() and selects shops on that
+    floor by their precomputed floor number, or
+    by the floor index of the SQLite store.
     Args:
         user_request (str): floor from user
         found_shops (list): found shops on user's
         request
+        lang (str): language of user's answer
+        store (SQLiteShopStore): store of found shops
     Returns:
         shops_by_floor (list): shops that was found by floor
     """
-    shops_by_floor = []
-    for shop in found_shops:
-        numbers = re.findall(r'\d+', shop['location'])
-        if len(numbers) > 0:
-            numbers = numbers[0]
-            num = pronounce_number(int(numbers), ordinals=False)
-            num_ordinal = pronounce_number(int(numbers), ordinals=True)
-            if num in user_request or num_ordinal in user_request:
-                shops_by_floor.append(shop)
-    return shops_by_floor
+    floor = resolve_floor(user_request, lang=lang)
+    if floor is None:
+        return []
+    if store is not None:
+        return store.shops_on_floor(
+            floor, {shop['name'] for shop in found_shops})
+    return [shop for shop in found_shops if shop_floor(shop) == floor]
 
-def parse(url):
-    headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36'
-        }
-    request = urllib.request.Request(url,
-                                    headers=headers)
+
+# floors spoken forms are prepared for, every two-word number
+MAX_FLOOR = 99
+
+
+def extract_floor(location):
+    """
+    Returns the first number in shop's location
+    as the floor number.
+    Examples:
+        'Street Level 1, near Centerstage' -> 1
+        'Ho'okipa Terrace' -> None
+    """
+    floor = re.search(r'\d+', location or '')
+    return int(floor.group()) if floor else None
+
+
+def shop_floor(shop):
+    """
+    Returns precomputed floor of the shop, extracts
+    it for shops cached without floor.
+    """
+    if 'floor' in shop:
+        return shop['floor']
+    return extract_floor(shop['location'])
+
+
+_floor_forms = {}
+_floor_forms_lock = threading.Lock()
+
+
+def floor_forms(max_floor=MAX_FLOOR, lang='en'):
+    """
+    Returns reverse map from spoken forms of floor
+    numbers to the numbers. Built once per process,
+    language and max_floor, callers must not modify it.
+    Returns:
+        forms (dict): phrase -> floor
+    Examples:
+        {'2': 2, '2nd': 2, 'two': 2, 'second': 2,
+         'level 2': 2, 'level two': 2, 'second floor': 2, ...}
+    """
+    forms = _floor_forms.get((lang, max_floor))
+    if forms is None:
+        with _floor_forms_lock:
+            forms = _floor_forms.get((lang, max_floor))
+            if forms is None:
+                forms = {}
+                for floor in range(max_floor, -1, -1):
+                    for phrase in _spoken_floor(floor, lang):
+                        forms[phrase] = floor
+                _floor_forms[lang, max_floor] = forms
+    return forms
+
+
+def _spoken_floor(floor, lang):
+    suffix = 'th' if 10 <= floor % 100 <= 20 else \
+        {1: 'st', 2: 'nd', 3: 'rd'}.get(floor % 10, 'th')
+    numbers = {str(floor), f'{floor}{suffix}',
+               normalize_name(spoken_number(floor, lang)),
+               normalize_name(spoken_number(floor, lang, ordinals=True))}
+    phrases = set(numbers)
+    for number in numbers:
+        for word in ('level', 'floor'):
+            phrases.add(f'{word} {number}')
+            phrases.add(f'{number} {word}')
+    return phrases
+
+
+def resolve_floor(user_request, forms=None, lang='en'):
+    """
+    Finds the floor user named in the answer.
+    Longer phrases are looked up first, so
+    'twenty one' is read as 21, not as 20.
+    Floors above MAX_FLOOR aren't recognized.
+    Args:
+        user_request (str): user's answer
+        forms (dict): spoken forms, floor_forms() by default
+        lang (str): language of user's answer
+    Returns:
+        floor (int): None if no floor was named
+    Examples:
+        'I am on the second floor' -> 2
+        'level 3' -> 3
+    """
+    if not user_request:
+        return None
+    forms = forms or floor_forms(lang=lang)
+    words = normalize_name(user_request).split()
+    for size in (3, 2, 1):
+        for i in range(len(words) - size + 1):
+            floor = forms.get(' '.join(words[i:i + size]))
+            if floor is not None:
+                return floor
+    return None
+
+
+def fetch_page(url, validators=None):
+    """
+    Downloads the page. If validators from the previous
+    download are given, sends a conditional request so an
+    unchanged page is not downloaded again.
+    Args:
+        url (str): page url
+        validators (dict): 'etag' and 'last_modified' of
+                           the previous response
+    Returns:
+        status (int): HTTP status, 304 if page not modified,
+                      None if request failed
+        page (bytes): page content or None
+        validators (dict): validators of this response
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
     try:
-        with urllib.request.urlopen(request) as page:
-            soup = bs4.BeautifulSoup(page.read(), features='lxml')
-            return soup
-    except HTTPError:
+        response = http_request('GET', url, headers=headers)
+    except _request_exception() as e:
+        LOG.info(f"Failed url parsing: {e}")
+        return None, None, {}
+    if response.status_code == 304:
+        LOG.info('Page not modified')
+        return 304, None, validators
+    if response.status_code != 200:
         LOG.info("Failed url parsing")
+        return response.status_code, None, {}
+    new_validators = {'etag': response.headers.get('ETag'),
+                      'last_modified': response.headers.get('Last-Modified')}
+    return response.status_code, response.content, new_validators
+
+
+def parse(url):
+    status, page, _ = fetch_page(url)
+    if page is not None:
+        import bs4
+        soup = bs4.BeautifulSoup(page, features='lxml')
+        return soup
 
 
-def get_shop_data(url, user_request, file_path):
+def get_shop_data(url, user_request, file_path, cache_ttl=None,
+                  backend='json', lang='en', batch=False):
     """
     Check existence of user's request store in cache
     if shop was found returns list with shop info,
@@ -237,16 +2908,32 @@ def get_shop_data(url, user_request, file_path):
     stores' info and does caching, else returns empty
     list.
     on the mall web-page
+    If the cache is older than cache_ttl it is
+    still used while a new one is built in the
+    background.
     Args:
         url (str): mall link from hardcoded in init.py
         user_request (str): utterance from stt parsing
+        cache_ttl (float): cache lifetime in seconds,
+                           None to never refresh
+        backend (str): 'json' or 'sqlite' cache storage
+        lang (str): language of the mall's page
+        batch (bool): resolve every shop named in the request
     Returns:
-        : found_shops (list): found shops' info
+        : found_shops (list): found shops' info, if batch
+                              (request part, found shops) pairs
     """
     # search for store existence in cache
     LOG.info(file_path)
-    found_shops, data = find_cached_stores(user_request, url, file_path)
+    age = get_directory(file_path).age()
+    if cache_ttl and age is not None and age > cache_ttl:
+        LOG.info(f"Mall's cache is {int(age)}s old, refreshing")
+        refresh_cache_in_background(file_path, url, backend, lang)
+    found_shops, data = find_cached_stores(user_request, url, file_path,
+                                           backend, lang, batch)
     LOG.info(found_shops)
+    if batch:
+        return found_shops or []
     if found_shops:
         LOG.info(f"found_shops: {found_shops}")
         return found_shops
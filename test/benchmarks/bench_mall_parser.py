@@ -0,0 +1,203 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmarks of mall page scraping, cache build, shop lookup,
+floor selection and open-now evaluation on synthetic directory
+pages of 100 to 100k shops served by MallServer.
+
+    python test/benchmarks/bench_mall_parser.py --save baseline.json
+    python test/benchmarks/bench_mall_parser.py --compare baseline.json
+
+With --compare, stages slower than the baseline by more than
+--threshold are reported and the script exits with code 1.
+"""
+
+import argparse
+import importlib.util
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from os.path import abspath, dirname
+from types import MethodType, SimpleNamespace
+
+sys.path.append(dirname(abspath(__file__)))
+from fixtures import tenants
+from mall_server import MallServer
+
+skill_dir = dirname(dirname(dirname(abspath(__file__))))
+
+SIZES = (100, 1000, 10000, 100000)
+# lookups timed per size, the result is the mean per lookup
+LOOKUPS = 200
+
+
+def load_skill():
+    """
+    Imports the skill package the way the skill loader does
+    Returns:
+        skill module, request_handling module
+    """
+    spec = importlib.util.spec_from_file_location(
+        'skill_directory', skill_dir + '/__init__.py',
+        submodule_search_locations=[skill_dir])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module, sys.modules['skill_directory.request_handling']
+
+
+def best_of(repeat, function, *args):
+    """
+    Returns the fastest of repeated calls in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_size(skill, rh, size, repeat):
+    """
+    Times every stage on a directory of the given size
+    Returns:
+        timings (dict): stage -> seconds
+    """
+    shops = tenants(size)
+    server = MallServer(shops, conditional=False).start()
+    url = server.url + 'en/directory/'
+    rand = random.Random(size)
+    queries = [rand.choice(shops)['name'] for _ in range(LOOKUPS // 2)] + \
+              [f'unknown shop {i}' for i in range(LOOKUPS // 2)]
+    timings = {}
+    try:
+        timings['parse'] = best_of(repeat, rh.parse, url)
+
+        def build_cache():
+            file_path = tempfile.mkdtemp()
+            try:
+                rh.caching_stores_in_mall(file_path, url)
+            finally:
+                shutil.rmtree(file_path)
+        timings['caching_stores_in_mall'] = best_of(repeat, build_cache)
+
+        file_path = tempfile.mkdtemp()
+        try:
+            rh.caching_stores_in_mall(file_path, url)
+
+            def lookups():
+                for query in queries:
+                    rh.find_cached_stores(query, url, file_path)
+            timings['find_cached_stores'] = \
+                best_of(repeat, lookups) / len(queries)
+        finally:
+            shutil.rmtree(file_path)
+    finally:
+        server.stop()
+
+    # selections run on found shops, which come from the cache
+    # with their hours and floor precomputed
+    cached = [shop for found in rh.build_shop_cache(shops).values()
+              for shop in found]
+    timings['shop_selection_by_floors'] = best_of(
+        repeat, rh.shop_selection_by_floors, 'second floor', cached)
+    # stands in for the skill instance, the JSON backend has no store
+    file_path = tempfile.mkdtemp()
+    try:
+        instance = SimpleNamespace(mall_registry=rh.MallRegistry(file_path))
+        instance.session_store = MethodType(
+            skill.DirectorySkill.session_store, instance)
+        session = rh.MallSession(None, 'http://127.0.0.1/', 'en')
+        timings['open_shops_search'] = best_of(
+            repeat, skill.DirectorySkill.open_shops_search, instance, cached,
+            ['10:15', 'am'], 10, 15, session)
+    finally:
+        shutil.rmtree(file_path)
+    return timings
+
+
+def compare(results, baseline, threshold):
+    """
+    Finds stages slower than baseline by more than threshold
+    Returns:
+        regressions (list): (size, stage, baseline, current)
+    """
+    regressions = []
+    for size, timings in results.items():
+        for stage, current in timings.items():
+            previous = baseline.get(size, {}).get(stage)
+            if previous and current > previous * (1 + threshold):
+                regressions.append((size, stage, previous, current))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma separated numbers of shops')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', metavar='FILE',
+                        help='write results as the new baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='baseline to compare results with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown, 0.2 is 20%%')
+    args = parser.parse_args()
+
+    skill, rh = load_skill()
+    results = {}
+    for size in map(int, args.sizes.split(',')):
+        results[str(size)] = bench_size(skill, rh, size, args.repeat)
+        for stage, seconds in results[str(size)].items():
+            print(f'{size:>7} {stage:<26} {seconds * 1000:12.3f} ms')
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, f, indent=4)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for size, stage, previous, current in regressions:
+            print(f'REGRESSION {size} {stage}: {previous * 1000:.3f} ms -> '
+                  f'{current * 1000:.3f} ms')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures skill load time: import of the skill package,
+create_skill(), initialize() and the cache warm-up it starts,
+each run in a fresh interpreter with an empty cache. Neon/Mycroft
+framework modules are imported before the timer starts, so
+only the skill's own imports and initialization are counted.
+The mall is served by MallServer, so language check and cache
+build don't depend on the network.
+
+    python test/benchmarks/bench_startup.py
+    python test/benchmarks/bench_startup.py --compare /path/to/old/checkout
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from os.path import abspath, dirname
+
+sys.path.append(dirname(abspath(__file__)))
+from fixtures import tenants
+from mall_server import MallServer
+
+skill_dir = dirname(dirname(dirname(abspath(__file__))))
+
+STAGES = ('import', 'create_skill', 'initialize', 'warm_up', 'startup')
+
+CHILD = """
+import importlib.util, json, shutil, sys, tempfile, threading, time
+import neon_utils.skills.neon_skill, mycroft.skills.core
+from ovos_utils.messagebus import FakeBus
+path, mall_link = sys.argv[1:3]
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location(
+    'skill_directory', path + '/__init__.py',
+    submodule_search_locations=[path])
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+skill = module.create_skill()
+created = time.perf_counter()
+# settings and file system like the skill loader sets them up
+skill.bind(FakeBus())
+skill.settings_write_path = skill.file_system.path = tempfile.mkdtemp()
+skill._init_settings()
+skill.settings['mall_link'] = mall_link
+loaded = time.perf_counter()
+skill.initialize()
+initialized = time.perf_counter()
+for thread in threading.enumerate():
+    if thread.name == 'mall-cache-warm-up':
+        thread.join()
+ready = time.perf_counter()
+shutil.rmtree(skill.file_system.path)
+print(json.dumps({'import': imported - start,
+                  'create_skill': created - imported,
+                  'initialize': initialized - loaded,
+                  'warm_up': ready - initialized,
+                  'startup': created - imported + ready - loaded}))
+"""
+
+
+def measure(path, runs, mall_link):
+    """
+    Returns median times in milliseconds of the skill
+    in path per stage, startup is create_skill() with
+    initialize() till the mall's cache is ready.
+    """
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD, path,
+                                 mall_link],
+                                check=True, capture_output=True,
+                                text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {stage: round(statistics.median(sample[stage]
+                                           for sample in samples) * 1000, 2)
+            for stage in STAGES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--shops', type=int, default=1000,
+                        help='number of shops on the mall page')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='another checkout of the skill to measure')
+    args = parser.parse_args()
+    with MallServer(tenants(args.shops)) as server:
+        results = {skill_dir: measure(skill_dir, args.runs, server.url)}
+        if args.compare:
+            results[abspath(args.compare)] = measure(
+                abspath(args.compare), args.runs, server.url)
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Synthetic mall directory pages for benchmarks, with the same
+directory-tenant-card markup as the mall's web-page.
+"""
+
+import random
+
+from html import escape
+
+WORDS = ['abc', 'apple', 'aloha', 'bay', 'blue', 'coast', 'crate', 'diamond',
+         'ewa', 'factory', 'garden', 'harbor', 'island', 'kai', 'lani',
+         'lotus', 'makai', 'mana', 'moana', 'nalu', 'ocean', 'palm', 'pearl',
+         'reef', 'sand', 'shell', 'sun', 'surf', 'tiki', 'wave']
+KINDS = ['Stores', 'Boutique', 'Cafe', 'Kitchen', 'Jewelers', 'Outfitters',
+         'Market', 'Studio', 'Gallery', 'Shoes', '& Co']
+HOURS = ['9am – 9pm', '10am – 8pm', '10am – 9pm', '7am – 2pm',
+         '10:30am – 8:30pm', '11am – 10pm', '6pm – 2am', 'Open 24 hours',
+         'Temporarily closed']
+WINGS = ['Street', 'Mall', 'Ho\'okipa Terrace', 'Ewa Wing', 'Diamond Head Wing']
+LANDMARKS = ['near Centerstage', 'in the Ewa Wing', 'near Nordstrom',
+             'by the escalators', 'next to the food court']
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"><title>Directory</title></head>
+<body>
+  <header class="site-header"><img src="/images/logo.svg" alt="Mall"></header>
+  <main class="directory">
+    <div class="directory-list">
+{cards}
+    </div>
+  </main>
+</body>
+</html>
+"""
+
+CARD = """      <div class="directory-tenant-card" data-id="{id}">
+        <a href="/en/directory/{slug}"><img src="{logo}" alt="{name}"></a>
+        <div class="tenant-info-container">
+          <div class="tenant-info-row">{name}</div>
+          <div class="tenant-hours-container">{hours}</div>
+          <div class="tenant-location-container">{location}</div>
+        </div>
+      </div>"""
+
+
+def tenants(count, seed=0):
+    """
+    Generates shops, about a fifth of them are
+    branches of chains sharing the same name.
+    Args:
+        count (int): number of shops
+        seed (int): random seed
+    Returns:
+        tenants (list): dicts with name, hours, location, logo
+    """
+    rand = random.Random(seed)
+    names = []
+    shops = []
+    for i in range(count):
+        if names and rand.random() < 0.2:
+            name = rand.choice(names)
+        else:
+            name = ' '.join([rand.choice(WORDS).title()
+                             for _ in range(rand.randint(1, 2))] +
+                            [rand.choice(KINDS), str(i)])
+            names.append(name)
+        floor = rand.randint(1, 4)
+        shops.append({
+            'name': name,
+            'hours': rand.choice(HOURS),
+            'location': f'{rand.choice(WINGS)} Level {floor}, '
+                        f'{rand.choice(LANDMARKS)}',
+            'logo': f'https://example.com/tenant-logos/{i}.png'
+        })
+    return shops
+
+
+def directory_page(shops):
+    """
+    Renders shops as the mall's directory page
+    Args:
+        shops (list): shops from tenants()
+    Returns:
+        page (bytes): utf-8 html
+    """
+    cards = '\n'.join(CARD.format(id=i, slug=f'tenant-{i}',
+                                  logo=escape(shop['logo']),
+                                  name=escape(shop['name']),
+                                  hours=escape(shop['hours']),
+                                  location=escape(shop['location']))
+                      for i, shop in enumerate(shops))
+    return PAGE.format(cards=cards).encode('utf-8')
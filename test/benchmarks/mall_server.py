@@ -0,0 +1,222 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Local stand-in for the mall's web-site. Serves /<lang>/directory/
+pages rendered from a tenant set, with injectable latency, errors,
+304 responses and missing languages, so the whole network and
+parsing path can be tested and load-tested offline.
+
+    python test/benchmarks/mall_server.py --tenants 1000 --port 8080
+
+and set the skill's mall_link to http://127.0.0.1:8080/
+"""
+
+import argparse
+import random
+import threading
+import time
+
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import abspath, dirname
+from sys import path
+
+path.append(dirname(abspath(__file__)))
+from fixtures import directory_page, tenants
+
+
+class MallServer:
+    """
+    Threaded HTTP server with the mall's directory pages.
+    Page responses carry ETag and Last-Modified, conditional
+    requests get 304 until the tenants change.
+    Args:
+        shops (list): tenants for the directory page,
+                      defaults to 100 generated shops
+        languages (iterable): languages with a directory page,
+                              others get 404
+        latency (float): seconds to wait before every response
+        error_rate (float): share of page requests answered with 503
+        conditional (bool): answer conditional requests with 304
+    Examples:
+        with MallServer(languages=['en', 'ja']) as server:
+            caching_stores_in_mall(file_path,
+                                   server.url + 'en/directory/')
+    """
+
+    def __init__(self, shops=None, languages=('en',), host='127.0.0.1',
+                 port=0, latency=0.0, error_rate=0.0, conditional=True):
+        self.languages = set(languages)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.conditional = conditional
+        self.requests = []
+        self._errors = []
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self.set_shops(tenants(100) if shops is None else shops)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        Returns:
+            url (str): value for the skill's mall_link setting
+        """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def set_shops(self, shops):
+        """
+        Replaces the tenants, cached copies become stale
+        """
+        with self._lock:
+            self.shops = shops
+            self.page = directory_page(shops)
+            self.version = getattr(self, 'version', 0) + 1
+            self.modified = formatdate(time.time(), usegmt=True)
+
+    def fail_next(self, status=503, count=1):
+        """
+        Answers the next count page requests with the status
+        """
+        with self._lock:
+            self._errors.extend([status] * count)
+
+    def _next_error(self):
+        with self._lock:
+            if self._errors:
+                return self._errors.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return 503
+        return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                self.respond(body=False)
+
+            def do_GET(self):
+                self.respond(body=True)
+
+            def respond(self, body):
+                server.requests.append((self.command, self.path))
+                if server.latency:
+                    time.sleep(server.latency)
+                parts = self.path.split('?')[0].strip('/').split('/')
+                if not parts[0]:
+                    return self.send(200, b'<html><body>Mall</body></html>',
+                                     body)
+                if len(parts) != 2 or parts[1] != 'directory' or \
+                        parts[0] not in server.languages:
+                    return self.send(404, b'Not Found', body)
+                error = server._next_error()
+                if error:
+                    return self.send(error, b'Error', body)
+                etag = f'"{server.version}"'
+                headers = {'ETag': etag, 'Last-Modified': server.modified}
+                if server.conditional and \
+                        self.headers.get('If-None-Match') == etag:
+                    return self.send(304, b'', False, headers)
+                self.send(200, server.page, body, headers)
+
+            def send(self, status, content, body, headers=None):
+                self.send_response(status)
+                if status != 304:
+                    self.send_header('Content-Type',
+                                     'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(content)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if body and status != 304:
+                    self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """
+        Serves in the calling thread until interrupted
+        """
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--tenants', type=int, default=100)
+    parser.add_argument('--languages', default='en',
+                        help='comma separated languages with a directory')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before every response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of page requests answered with 503')
+    parser.add_argument('--no-304', action='store_true',
+                        help='ignore conditional requests')
+    args = parser.parse_args()
+    server = MallServer(tenants(args.tenants), args.languages.split(','),
+                        port=args.port, latency=args.latency,
+                        error_rate=args.error_rate,
+                        conditional=not args.no_304)
+    print(f'Serving {args.tenants} shops at {server.url}')
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
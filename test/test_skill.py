@@ -26,18 +26,38 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import bs4
+import json
 import shutil
+import sys
+import tempfile
 import unittest
 
 from os import mkdir
 from os.path import dirname, join, exists
-from mock import Mock
+from threading import Event
+from mock import Mock, patch
 from ovos_utils.messagebus import FakeBus
 
 from mycroft.skills.skill_loader import SkillLoader
 
 from mycroft_bus_client import Message
 
+sys.path.append(dirname(dirname(__file__)))
+from request_handling import LatencyHistograms, MallRegistry, MallSession,\
+                             QueryTimer, SQLiteShopStore, ShopDirectory,\
+                             ShopNameIndex, Tenant, build_shop_cache,\
+                             cancel_refresh, caching_stores_in_mall,\
+                             diff_shop_cache, existing_lang_check,\
+                             extract_tenants, find_cached_stores,\
+                             get_cache_stats, open_all_day, parse_hours,\
+                             refresh_cache_in_background, resolve_floor,\
+                             shop_hours_arrays, tenant_to_json,\
+                             tenants_from_json, write_cache_file
+sys.path.append(join(dirname(__file__), 'benchmarks'))
+from fixtures import tenants
+from mall_server import MallServer
+
 
 class TestSkill(unittest.TestCase):
 
@@ -103,6 +123,170 @@ class TestSkill(unittest.TestCase):
         result_shops = self.skill.open_shops_search(shop_info, day_time, hour, min)
         self.assertEqual(shop_info[0], result_shops[0])
 
+    def test_en_time_calculation_24_hours(self):
+        shop_info = [{'name': 'ABC Stores', 'hours': 'Open 24 hours',
+                      'location': 'Street Level 1', 'logo': None}]
+        with patch.object(self.skill, 'speak_shops'):
+            self.skill.time_calculation(shop_info, True, ['11:20', 'pm'],
+                                        11, 20)
+        self.skill.speak_dialog.assert_called_once_with(
+            'open_now', {'shop_name': 'ABC Stores'})
+
+    def test_cancel_query_keeps_cache_refresh(self):
+        shops = [{'name': 'ABC Stores', 'hours': '9am – 9pm',
+                  'location': 'Street Level 1', 'logo': 'abc.png'}]
+        with MallServer(shops, latency=0.5) as server:
+            refresh = self.skill.mall_registry.refresh(server.url, 'en')
+            self.skill._query_future = \
+                self.skill._query_executor.submit(refresh.result)
+            # a new question stops only the query waiting for the refresh
+            self.assertTrue(self.skill._cancel_query())
+            self.assertEqual(refresh.result(), 200)
+
+    def test_settings_changed(self):
+        registry = self.skill.mall_registry
+        self.assertEqual(registry.backend, 'json')
+        self.skill.settings['storage_backend'] = 'sqlite'
+        # settings apply when they change, not in the middle of a query
+        self.assertEqual(self.skill.mall_registry.backend, 'json')
+        self.skill.on_settings_changed()
+        self.assertEqual(registry.backend, 'sqlite')
+        del self.skill.settings['storage_backend']
+        self.skill.on_settings_changed()
+        self.assertEqual(registry.backend, 'json')
+
+    def test_execute_one_shop(self):
+        with MallServer(self.shops()) as server:
+            self.skill.mall_registry.refresh(server.url, 'en').result()
+            self.skill.ask_yesno = Mock(return_value='no')
+            with patch.object(self.skill, 'speak_shops') as speak_shops:
+                self.skill.execute('abc stores', server.url)
+        # search -> again -> done
+        self.assertEqual(self.spoken(speak_shops),
+                         [('ABC Stores', 'Street Level 1')])
+        self.skill.ask_yesno.assert_called_once_with('ask_more')
+        self.skill.speak_dialog.assert_called_with('no_shop_request')
+
+    def test_execute_select_and_another_shop(self):
+        with MallServer(self.shops()) as server:
+            self.skill.mall_registry.refresh(server.url, 'en').result()
+            self.skill.ask_yesno = Mock(side_effect=['yes', 'no'])
+            self.skill.get_response = Mock(
+                side_effect=['time', 'foot locker level 2'])
+            with patch.object(self.skill, 'speak_shops') as speak_shops, \
+                    patch.object(self.skill, 'shops_by_time_selection') \
+                    as by_time, \
+                    patch.object(self.skill, 'location_selection') \
+                    as by_location:
+                self.skill.execute('apple', server.url)
+        # search -> select -> again -> search -> again -> done,
+        # the answer names a shop, it isn't a follow-up question
+        self.assertEqual(self.spoken(by_time),
+                         [('Apple', 'Mall Level 1'),
+                          ('Apple', 'Mall Level 2')])
+        by_location.assert_not_called()
+        self.assertEqual(self.spoken(speak_shops),
+                         [('Foot Locker', 'Mall Level 2')])
+        self.assertEqual(self.skill.ask_yesno.call_count, 2)
+
+    def test_execute_select_latency(self):
+        with MallServer(self.shops()) as server:
+            self.skill.mall_registry.refresh(server.url, 'en').result()
+            self.skill.ask_yesno = Mock(return_value='no')
+            self.skill.get_response = Mock(return_value='time')
+            self.skill._query_timer = QueryTimer()
+            with patch.object(self.skill.bus, 'emit') as emit, \
+                    patch.object(self.skill.gui, 'show_image'):
+                self.skill.execute('apple', server.url)
+        # the answer about the branches is a part of the query
+        latency = [call[0][0].data for call in emit.call_args_list
+                   if call[0][0].msg_type == 'mall-guide.query.latency']
+        self.assertEqual(len(latency), 1)
+        self.assertIn('name_match', latency[0]['stages'])
+        self.assertIn('speak', latency[0]['stages'])
+
+    def test_execute_follow_up(self):
+        with MallServer(self.shops()) as server:
+            self.skill.mall_registry.refresh(server.url, 'en').result()
+            self.skill.ask_yesno = Mock(side_effect=['yes', 'no'])
+            self.skill.get_response = Mock(
+                side_effect=['location', 'which one is open'])
+            with patch.object(self.skill, 'shops_by_time_selection') \
+                    as by_time, \
+                    patch.object(self.skill, 'location_selection') \
+                    as by_location:
+                self.skill.execute('apple', server.url)
+        # search -> select -> again -> again -> done
+        self.assertEqual(self.spoken(by_location),
+                         [('Apple', 'Mall Level 1'),
+                          ('Apple', 'Mall Level 2')])
+        self.assertEqual(self.spoken(by_time), self.spoken(by_location))
+        # selections use the store of the session's mall
+        self.assertEqual(by_location.call_args[1]['session'].link, server.url)
+        self.assertEqual(by_time.call_args[0][1].link, server.url)
+
+    def test_execute_several_shops(self):
+        with MallServer(self.shops()) as server:
+            self.skill.mall_registry.refresh(server.url, 'en').result()
+            self.skill.ask_yesno = Mock(return_value='no')
+            with patch.object(self.skill.gui, 'show_image') as show_image, \
+                    patch.object(self.skill.mall_registry.logos,
+                                 'local_path', return_value=None):
+                self.skill.execute('abc stores and apple', server.url)
+        # one answer about all shops, one image on the screen
+        self.skill.speak.assert_called_once()
+        show_image.assert_called_once_with(
+            'abc.png', caption='ABC Stores, Apple', title='ABC Stores')
+
+    def test_execute_one_shop_of_several_parts(self):
+        with MallServer(self.shops()) as server:
+            self.skill.mall_registry.refresh(server.url, 'en').result()
+            self.skill.ask_yesno = Mock(return_value='no')
+            self.skill.get_response = Mock(return_value='location')
+            with patch.object(self.skill, 'speak_found_shops') \
+                    as speak_found_shops, \
+                    patch.object(self.skill, 'location_selection') \
+                    as by_location:
+                self.skill.execute('apple, please', server.url)
+        # "please" isn't a shop, branches of Apple are selected
+        speak_found_shops.assert_not_called()
+        self.assertEqual(self.spoken(by_location),
+                         [('Apple', 'Mall Level 1'),
+                          ('Apple', 'Mall Level 2')])
+
+    def test_execute_not_found(self):
+        with MallServer(self.shops()) as server:
+            self.skill.mall_registry.refresh(server.url, 'en').result()
+            self.skill.ask_yesno = Mock(return_value='no')
+            self.skill.get_response = Mock(side_effect=['abc stores'])
+            with patch.object(self.skill, 'speak_shops') as speak_shops:
+                self.skill.execute('zzzz', server.url)
+        # search -> search -> again -> done
+        self.skill.get_response.assert_called_once_with('shop_not_found')
+        self.assertEqual(self.spoken(speak_shops),
+                         [('ABC Stores', 'Street Level 1')])
+
+    @staticmethod
+    def spoken(method):
+        """
+        Returns names and locations of the shops
+        passed to the mocked method's only call
+        """
+        method.assert_called_once()
+        return [(shop['name'], shop['location'])
+                for shop in method.call_args[0][0]]
+
+    @staticmethod
+    def shops():
+        return [{'name': 'ABC Stores', 'hours': '9am – 9pm',
+                 'location': 'Street Level 1', 'logo': 'abc.png'},
+                {'name': 'Apple', 'hours': '10am – 8pm',
+                 'location': 'Mall Level 1', 'logo': 'apple.png'},
+                {'name': 'Apple', 'hours': '10am – 9pm',
+                 'location': 'Mall Level 2', 'logo': 'apple.png'},
+                {'name': 'Foot Locker', 'hours': '10am – 8pm',
+                 'location': 'Mall Level 2', 'logo': 'foot.png'}]
+
     # def test_en_time_extraction(self):
     #     shop_info = [{'name': 'ABC Stores', 'hours': '9am – 9pm', 'location': 'Street Level 1, near Centerstage', 'logo': 'https://gizmostorageprod.blob.core.windows.net/tenant-logos/1615937914061-abcstores.png'}, 
     #                     {'name': 'ABC Stores', 'hours': '10am – 8pm', 'location': 'Street Level 1, in the Ewa Wing', 'logo': 'https://gizmostorageprod.blob.core.windows.net/tenant-logos/1615937946329-abcstores.png'},
@@ -115,5 +299,308 @@ class TestSkill(unittest.TestCase):
         # print(self.skill.time_calculation(shop_info, False, day_time, hour, min))
 
 
+def extract_tenants_soup(page):
+    """
+    Reference BeautifulSoup implementation of
+    extract_tenants(), scanning forward from every
+    tenant card like the skill used to. Verifies
+    the lxml path produces the same shops.
+    Args:
+        page (bytes|str): directory page html
+    Returns:
+        tenants (list): shop dicts in page order
+    """
+    tenants = []
+    soup = bs4.BeautifulSoup(page, features='lxml')
+    for shop in soup.find_all(attrs={"class": "directory-tenant-card"}):
+            logo = shop.find_next("img").get('src')
+            info = shop.find_next(attrs={"class": "tenant-info-container"})
+            name = info.find_next(attrs={"class": "tenant-info-row"}).text.strip().strip('\n')
+            hours = info.find_next(attrs={"class": "tenant-hours-container"}).text.strip('\n')
+            location = info.find_next(attrs={"tenant-location-container"}).text.strip('\n')
+            tenants.append(Tenant(name, hours, location, logo))
+    return tenants
+
+
+class TestRequestHandling(unittest.TestCase):
+
+    def test_extract_tenants(self):
+        with open(join(dirname(__file__), 'fixtures', 'directory.html'),
+                  'rb') as f:
+            page = f.read()
+        tenants = extract_tenants(page)
+        self.assertEqual(tenants, extract_tenants_soup(page))
+        self.assertEqual(len(tenants), 6)
+        self.assertEqual(tenants[0], {
+            'name': 'ABC Stores', 'hours': '9am – 9pm',
+            'location': 'Street Level 1, near Centerstage',
+            'logo': 'https://gizmostorageprod.blob.core.windows.net/'
+                    'tenant-logos/1615937914061-abcstores.png'})
+
+    def test_name_index_best_match(self):
+        index = ShopNameIndex(['Abcun', 'ABC Stores', 'Apple',
+                               'Barnes & Noble', "Macy's"])
+        self.assertEqual(index.best_match('ABC stores'), 'ABC Stores')
+        self.assertEqual(index.best_match('abc'), 'ABC Stores')
+        self.assertEqual(index.best_match('where is apple'), 'Apple')
+        self.assertEqual(index.best_match('barnes and noble'),
+                         'Barnes & Noble')
+        self.assertEqual(index.best_match('macys'), "Macy's")
+        self.assertIsNone(index.best_match('nothing here'))
+        self.assertEqual(index.search('apple or abc stores', limit=2),
+                         [(0.9, 'ABC Stores'), (0.9, 'Apple')])
+        scores = [score for score, _ in index.search('abc')]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_name_index_phonetic(self):
+        index = ShopNameIndex(['ABC Stores', 'Barnes & Noble', "Macy's",
+                               'Sephora', 'Nordstrom'])
+        self.assertEqual(index.best_match('macies'), "Macy's")
+        self.assertEqual(index.best_match('sefora'), 'Sephora')
+        self.assertEqual(index.best_match('barns and nobel'),
+                         'Barnes & Noble')
+        self.assertEqual(index.best_match('a b c stores'), 'ABC Stores')
+        self.assertIsNone(index.best_match('zzzz'))
+
+    def test_name_index_phonetic_large(self):
+        # many names share the query's words, the misheard one
+        # must still be among the names compared by spelling
+        index = ShopNameIndex(shop['name'] for shop in tenants(10000))
+        self.assertEqual(index.best_match('wava surf gallery 2425'),
+                         'Wave Surf Gallery 2425')
+
+    def test_name_index_resolve(self):
+        index = ShopNameIndex(['ABC Stores', 'Apple', 'Barnes & Noble',
+                               "Macy's"])
+        self.assertEqual(index.resolve('abc stores and apple'),
+                         [('abc stores', 'ABC Stores'), ('apple', 'Apple')])
+        self.assertEqual(index.resolve('barnes and noble'),
+                         [('barnes and noble', 'Barnes & Noble')])
+        self.assertEqual(index.resolve('macys, apple or zara'),
+                         [('macys', "Macy's"), ('apple', 'Apple'),
+                          ('zara', None)])
+
+    def test_directory_snapshot(self):
+        file_path = tempfile.mkdtemp()
+        caching_file = join(file_path, 'cached_stores.json')
+        cache = build_shop_cache([
+            Tenant('Apple', '9am – 9pm', 'Mall Level 2'),
+            Tenant('Zara', '10am – 8pm', 'Mall Level 1')])
+        write_cache_file(caching_file, cache)
+        directory = ShopDirectory(caching_file)
+        directory.load(cache)
+        snapshot = directory.snapshot()
+        new_cache, changes = diff_shop_cache(cache, [
+            {'name': 'Zara', 'hours': '10am – 8pm',
+             'location': 'Mall Level 1', 'logo': None},
+            {'name': "Macy's", 'hours': 'Open 24 hours',
+             'location': 'Mall Level 1', 'logo': None}])
+        directory.update(new_cache, changes)
+        # lookups holding the old snapshot keep using its data and index
+        name = snapshot.index.best_match('apple')
+        self.assertEqual(snapshot.data[name][0]['location'], 'Mall Level 2')
+        self.assertIsNone(directory.find('apple'))
+        self.assertEqual(directory.find('macys'), new_cache["Macy's"])
+        # only rows of the changed shops were updated
+        self.assertIs(directory.snapshot().shops[1], cache['Zara'][0])
+        self.assertEqual(directory.open_now(9 * 60), new_cache["Macy's"])
+        self.assertEqual(directory.open_now(11 * 60),
+                         cache['Zara'] + new_cache["Macy's"])
+        shutil.rmtree(file_path)
+
+    def test_parse_hours(self):
+        self.assertEqual(parse_hours('9am – 9pm'), (540, 1260))
+        self.assertEqual(parse_hours('10:30 a.m. - 12am'), (630, 0))
+        self.assertEqual(parse_hours('Open 24 Hours'), (0, 1440))
+        self.assertEqual(parse_hours('12am – 12am'), (0, 1440))
+        opens, closes = shop_hours_arrays([{'hours': 'Open 24 hours'},
+                                           {'hours': '6pm – 2am'}])
+        self.assertEqual(open_all_day(opens, closes).tolist(), [True, False])
+        self.assertEqual(parse_hours('Closed'), (None, None))
+
+    def test_resolve_floor(self):
+        self.assertEqual(resolve_floor('the second floor'), 2)
+        self.assertEqual(resolve_floor('level twenty one'), 21)
+        self.assertEqual(resolve_floor('twenty'), 20)
+        self.assertIsNone(resolve_floor('near the food court'))
+
+    def test_mall_server_refresh(self):
+        shops = [{'name': 'ABC Stores', 'hours': '9am – 9pm',
+                  'location': 'Street Level 1', 'logo': 'abc.png'}]
+        file_path = tempfile.mkdtemp()
+        with MallServer(shops, languages=['en']) as server:
+            self.assertEqual(existing_lang_check('en', server.url),
+                             (True, server.url + 'en/directory/'))
+            self.assertFalse(existing_lang_check('ja', server.url)[0])
+            url = server.url + 'en/directory/'
+            self.assertEqual(caching_stores_in_mall(file_path, url), 200)
+            self.assertEqual(caching_stores_in_mall(file_path, url), 304)
+            server.set_shops(shops + [{'name': 'Apple', 'hours': '',
+                                       'location': 'Mall Level 2',
+                                       'logo': 'apple.png'}])
+            self.assertEqual(caching_stores_in_mall(file_path, url), 200)
+            found, _ = find_cached_stores('apple', url, file_path)
+            self.assertEqual(found[0]['location'], 'Mall Level 2')
+            find_cached_stores('nothing here', url, file_path)
+            stats = get_cache_stats(file_path).as_dict()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        shutil.rmtree(file_path)
+
+    def test_sqlite_store(self):
+        cache = build_shop_cache([
+            Tenant('ABC Stores', '9am – 9pm', 'Street Level 1'),
+            Tenant('ABC Stores', '7am – 2pm', 'Mall Level 2'),
+            Tenant('Apple', '10am – 8pm', 'Mall Level 2')])
+        macys = build_shop_cache([Tenant("Macy's", '10am – 9pm',
+                                         'Mall Level 1')])["Macy's"]
+        no_fts = 'CREATE VIRTUAL TABLE shops_fts USING no_such_module(x)'
+        for schema in (SQLiteShopStore._fts_schema, no_fts):
+            file_path = tempfile.mkdtemp()
+            with patch.object(SQLiteShopStore, '_fts_schema', schema):
+                store = SQLiteShopStore(join(file_path, 'cached_stores.db'))
+            self.assertEqual(store.has_fts, schema != no_fts)
+            store.write(cache)
+            self.assertEqual(len(store), 3)
+            self.assertEqual(store.find('abc stores'), cache['ABC Stores'])
+            self.assertEqual(store.names('apple'), ['Apple'])
+            self.assertTrue(store.apply(cache['Apple'], macys))
+            self.assertFalse(store.apply(cache['Apple'], []))
+            self.assertEqual(store.names('apple'), [])
+            self.assertEqual(store.find('macies'), macys)
+            self.assertEqual(store.find_all('abc stores and macys'),
+                             [('abc stores', cache['ABC Stores']),
+                              ('macys', macys)])
+            self.assertEqual(store.shops_on_floor(2, ['ABC Stores']),
+                             cache['ABC Stores'][1:])
+            self.assertEqual(store.open_now(8 * 60, ['ABC Stores',
+                                                     "Macy's"]),
+                             cache['ABC Stores'][1:])
+            shutil.rmtree(file_path)
+
+    def test_refresh_after_cancel(self):
+        shops = [{'name': 'ABC Stores', 'hours': '9am – 9pm',
+                  'location': 'Street Level 1', 'logo': 'abc.png'}]
+        file_path = tempfile.mkdtemp()
+        with MallServer(shops, latency=0.3) as server:
+            url = server.url + 'en/directory/'
+            cancelled = refresh_cache_in_background(file_path, url)
+            self.assertTrue(cancel_refresh(file_path))
+            # the next query doesn't get the refresh being cancelled
+            future = refresh_cache_in_background(file_path, url)
+            self.assertIsNot(future, cancelled)
+            self.assertEqual(future.result(), 200)
+            found, _ = find_cached_stores('abc stores', url, file_path)
+            self.assertEqual(found[0]['location'], 'Street Level 1')
+        shutil.rmtree(file_path)
+
+    def test_forced_refresh_after_running(self):
+        shops = [{'name': 'ABC Stores', 'hours': '9am – 9pm',
+                  'location': 'Street Level 1', 'logo': 'abc.png'}]
+        file_path = tempfile.mkdtemp()
+        with MallServer(shops, latency=0.3) as server:
+            url = server.url + 'en/directory/'
+            self.assertEqual(
+                refresh_cache_in_background(file_path, url).result(), 200)
+            running = refresh_cache_in_background(file_path, url)
+            forced = refresh_cache_in_background(file_path, url, force=True)
+            # the forced refresh rebuilds the cache after the running one
+            self.assertIsNot(forced, running)
+            self.assertIs(refresh_cache_in_background(file_path, url),
+                          forced)
+            self.assertEqual(running.result(), 304)
+            self.assertEqual(forced.result(), 200)
+        shutil.rmtree(file_path)
+
+    def test_registry_refresh_reported_once(self):
+        shops = [{'name': 'ABC Stores', 'hours': '9am – 9pm',
+                  'location': 'Street Level 1', 'logo': 'abc.png'}]
+        file_path = tempfile.mkdtemp()
+        registry = MallRegistry(file_path)
+        registry.on_change = Mock()
+        with MallServer(shops, latency=0.3) as server, \
+                patch.object(registry, 'prefetch_logos') as prefetch_logos:
+            # queries of a stale cache join the running refresh
+            futures = [registry.refresh(server.url, 'en') for _ in range(3)]
+            self.assertEqual(len(set(futures)), 1)
+            # callbacks run in order, this one after the registry's
+            reported = Event()
+            futures[0].add_done_callback(lambda _: reported.set())
+            self.assertTrue(reported.wait(10))
+            self.assertEqual(futures[0].result(), 200)
+        registry.on_change.assert_called_once()
+        prefetch_logos.assert_called_once_with(server.url, 'en')
+        shutil.rmtree(file_path)
+
+    def test_shard_path_lang(self):
+        file_path = tempfile.mkdtemp()
+        registry = MallRegistry(file_path)
+        self.assertTrue(registry.shard_path('https://mall/', 'en').startswith(
+            join(file_path, 'malls')))
+        for lang in ('../../x', 'en/../..', 'EN', 'en\n', None):
+            with self.assertRaises(ValueError):
+                registry.shard_path('https://mall/', lang)
+        shutil.rmtree(file_path)
+
+    def test_tenant_json_round_trip(self):
+        shop_cache = build_shop_cache([Tenant('ABC Stores', '9am – 9pm',
+                                              'Street Level 1', 'abc.png')])
+        shop = shop_cache['ABC Stores'][0]
+        self.assertEqual((shop['opens'], shop['closes'], shop['floor']),
+                         (540, 1260, 1))
+        record = json.loads(json.dumps(shop_cache, default=tenant_to_json))
+        self.assertEqual(record['ABC Stores'][0], shop.to_dict())
+        self.assertEqual(tenants_from_json(record), shop_cache)
+        for hours in ('Open 24 hours', '12am – 12am'):
+            self.assertEqual(build_shop_cache([Tenant(
+                'ABC Stores', hours, 'Street Level 1')])[
+                'ABC Stores'][0]['spoken_hours'], 'open 24 hours')
+        self.assertIsNone(shop.get('missing'))
+        with self.assertRaises(KeyError):
+            shop['missing'] = 1
+
+    def test_diff_shop_cache(self):
+        def shops():
+            return [{'name': 'ABC Stores', 'hours': '9am – 9pm',
+                     'location': 'Street Level 1', 'logo': 'abc.png'},
+                    {'name': 'ABC Stores', 'hours': '9am – 9pm',
+                     'location': 'Mall Level 2', 'logo': 'abc.png'},
+                    {'name': 'Apple', 'hours': '10am – 8pm',
+                     'location': 'Mall Level 2', 'logo': 'apple.png'}]
+        cache = build_shop_cache(shops())
+        tenants = shops()
+        tenants[1]['hours'] = '10am – 9pm'
+        tenants[2] = {'name': "Macy's", 'hours': '10am – 9pm',
+                      'location': 'Mall Level 1', 'logo': 'macys.png'}
+        new_cache, changes = diff_shop_cache(cache, tenants)
+        self.assertEqual(new_cache, build_shop_cache(tenants))
+        self.assertIs(new_cache['ABC Stores'][0], cache['ABC Stores'][0])
+        self.assertEqual((changes['inserted'], changes['updated'],
+                          changes['deleted'], changes['unchanged']),
+                         (["Macy's"], ['ABC Stores'], ['Apple'], 1))
+
+    def test_mall_session(self):
+        session = MallSession('abc stores', 'https://mall/', 'en')
+        self.assertEqual(session.state, MallSession.SEARCH)
+        session.attempts = 2
+        session.new_request(None)
+        self.assertEqual((session.state, session.attempts),
+                         (MallSession.AGAIN, 0))
+        with self.assertRaises(AttributeError):
+            session.history = []
+
+    def test_latency_histograms(self):
+        timer = QueryTimer()
+        with timer.span('name_match'):
+            pass
+        self.assertEqual(list(timer.summary()['stages']), ['name_match'])
+        histograms = LatencyHistograms()
+        for ms in range(1, 101):
+            histograms.add({'stages': {'scrape': ms}, 'total': ms})
+        report = histograms.report()['scrape']
+        self.assertEqual(report['count'], 100)
+        self.assertEqual((report['p50'], report['p95'], report['p99']),
+                         (50, 95, 99))
+
+
 if __name__ == '__main__':
     unittest.main()